@@ -17,8 +17,45 @@ from interface import Menu
 from utils import *
 import common as C
 
+# options for solving a whole pack without any window
+solve_options = {
+    'pack': None,
+    'output': 'solutions.json',
+    'time_limit': None,
+    'memory_limit': 1024,
+    'node_limit': None,
+    'checkpoint_dir': None,
+    'jobs': None,
+    'bidirectional': False,
+    'engine': 'astar',
+    'mode': 'weighted',
+    'warm_cache': False,
+    'portfolio': False,
+}
+
+# options for the benchmark of the solver
+bench_options = {
+    'run': False,
+    'baseline': None,
+    'save_baseline': False,
+}
+
+
 def display_help():
-    print("Usage: ./Sokoban.py [-h] [-v] [--no-sound]")
+    print("Usage: ./Sokoban.py [-h] [-v] [--no-sound] [--portfolio]")
+    print("                    [--mode MODE]")
+    print("       ./Sokoban.py --solve-pack PACK [--output FILE]")
+    print("                    [--time-limit SEC] [--memory-limit MB] [--jobs N]")
+    print("                    [--node-limit N]")
+    print("                    [--bidirectional] [--engine astar|ida]")
+    print("                    [--mode MODE]")
+    print("                    [--warm-cache] [--portfolio]")
+    print("                    [--checkpoint-dir DIR]")
+    print("       ./Sokoban.py --benchmark [--baseline FILE] [--save-baseline]")
+    print("                    [--time-limit SEC] [--memory-limit MB] [--jobs N]")
+    print("                    [--node-limit N]")
+    print("                    [--bidirectional] [--engine astar|ida]")
+    print("                    [--mode MODE]")
     print("List of options:")
     print("    --help")
     print("    -h  display this help message")
@@ -26,17 +63,99 @@ def display_help():
     print("    -v  verbose mode")
     print("    --no-sound")
     print("        disable sound effects")
+    print("    --portfolio")
+    print("        solve levels with several configurations of the solver")
+    print("        racing on separate cores, the first solution wins")
+    print("        (with --solve-pack, --jobs N keeps the first N of them)")
+    print("    --solve-pack PACK")
+    print("        solve all levels of PACK (e.g., microban.txt) without")
+    print("        opening the game window")
+    print("    --output FILE")
+    print("        where to write solutions and statistics, as CSV if FILE")
+    print("        ends with .csv, as JSON otherwise (default: solutions.json)")
+    print("    --time-limit SEC")
+    print("        time limit to solve each level (default: 60, or 300 for")
+    print("        the benchmark)")
+    print("    --memory-limit MB")
+    print("        memory limit to solve each level (default: 1024)")
+    print("    --node-limit N")
+    print("        maximum number of states explored for each level")
+    print("        (default: no limit, or 10000 for the benchmark)")
+    print("    --jobs N")
+    print("        number of levels solved in parallel (default: all cores)")
+    print("    --bidirectional")
+    print("        also search backward from the solved position")
+    print("    --engine astar|ida")
+    print("        search engine: A* (default), or iterative deepening A*")
+    print("        which needs much less memory")
+    print("    --mode weighted|greedy|pushes|moves")
+    print("        search mode: weighted A* (default), greedy (quicker, longer")
+    print("        solutions), or optimal in number of pushes or of moves")
+    print("    --warm-cache")
+    print("        add the solutions to the solution cache used in the game")
+    print("    --checkpoint-dir DIR")
+    print("        save long searches in DIR from time to time, and resume")
+    print("        them when solving the pack again (astar engine only)")
+    print("    --benchmark")
+    print("        solve a fixed subset of the Large Test Suite Sets and")
+    print("        compare the results to a baseline")
+    print("    --baseline FILE")
+    print("        baseline of the benchmark (default: assets/benchmark.json)")
+    print("    --save-baseline")
+    print("        replace the baseline by the results of the benchmark")
+
+
+def option_value(args, o, conv=str):
+    if not args:
+        print("Missing value for option", o)
+        display_help()
+        exit(1)
+    return conv(args.pop(0))
 
 
 def parse_options():
-    for o in sys.argv:
+    args = sys.argv[1:]
+    while args:
+        o = args.pop(0)
         if o == "-v" or o == "--verbose":
             set_verbose()
         elif o == "--no-sound":
             C.WITH_SOUND = False
+        elif o == "--portfolio":
+            C.PORTFOLIO = True
+            solve_options['portfolio'] = True
         elif o == "-h" or o == "--help":
             display_help()
             exit(0)
+        elif o == "--solve-pack":
+            solve_options['pack'] = option_value(args, o)
+        elif o == "--output":
+            solve_options['output'] = option_value(args, o)
+        elif o == "--time-limit":
+            solve_options['time_limit'] = option_value(args, o, float)
+        elif o == "--memory-limit":
+            solve_options['memory_limit'] = option_value(args, o, int)
+        elif o == "--node-limit":
+            solve_options['node_limit'] = option_value(args, o, int)
+        elif o == "--jobs":
+            solve_options['jobs'] = option_value(args, o, int)
+        elif o == "--bidirectional":
+            solve_options['bidirectional'] = True
+        elif o == "--engine":
+            solve_options['engine'] = option_value(args, o)
+        elif o == "--mode":
+            solve_options['mode'] = option_value(args, o)
+            C.SOLVE_MODE = solve_options['mode']
+        elif o == "--checkpoint-dir":
+            solve_options['checkpoint_dir'] = option_value(args, o)
+        elif o == "--warm-cache":
+            solve_options['warm_cache'] = True
+        elif o == "--benchmark":
+            bench_options['run'] = True
+        elif o == "--baseline":
+            bench_options['baseline'] = option_value(args, o)
+        elif o == "--save-baseline":
+            bench_options['save_baseline'] = True
 
 
 def main():
@@ -44,6 +163,35 @@ def main():
     parse_options()
     verbose("Verbose mode activated")  # will only print if option was set
 
+    # options left to their default value are not given
+    options = {k: v for k, v in solve_options.items() if v is not None}
+
+    if bench_options['run']:
+        import benchmark
+        for k in ('pack', 'output', 'warm_cache', 'portfolio',
+                  'checkpoint_dir'):
+            options.pop(k, None)
+        if bench_options['baseline'] is not None:
+            options['baseline'] = bench_options['baseline']
+        try:
+            regressions = benchmark.run_benchmark(
+                save_baseline=bench_options['save_baseline'], **options)
+        except ValueError as e:
+            # options that cannot go together
+            print("Error:", e)
+            sys.exit(1)
+        sys.exit(1 if regressions else 0)
+
+    if solve_options['pack'] is not None:
+        # headless solving, no window needed
+        import batch
+        try:
+            batch.solve_pack(**options)
+        except ValueError as e:
+            print("Error:", e)
+            sys.exit(1)
+        return
+
     # read scores and current pack / last level information
     scores.load_scores()
 
@@ -68,5 +216,6 @@ def debug_signal_handler(signal, frame):
 
 if __name__ == "__main__":
     import signal
-    signal.signal(signal.SIGINT, debug_signal_handler)
+    if "--solve-pack" not in sys.argv and "--benchmark" not in sys.argv:
+        signal.signal(signal.SIGINT, debug_signal_handler)
     main()
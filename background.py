@@ -0,0 +1,122 @@
+"""
+Solving in a worker process, so that the game window keeps being updated
+during long searches.
+The worker gets its own copy of the level, reports its progress and its
+result on a queue, and is asked to stop on another queue.
+"""
+
+import queue
+import resource
+import multiprocessing
+from level import Level
+import common as C
+
+# a fresh interpreter for the worker, rather than a copy of the game process
+# with its window
+context = multiprocessing.get_context('spawn')
+
+
+def solve_task(filename, levelnum, state, task, args, options, memory_limit,
+               requests, results):
+    """
+    Worker process: solve the level 'levelnum' of pack 'filename' from
+    'state', with task 'all', 'one' or 'move' as in the game, and 'options'
+    for the search engine (only 'budget' for tasks other than 'all').
+    The result is sent with the explored states, the elapsed time and the
+    statistics of the search (None if the solution was in the cache).
+    """
+    last = [0]
+    stats = [0, 0]
+
+    def progress(explored, elapsed):
+        stats[:] = explored, elapsed
+        # at most one report per frame of the game
+        if elapsed - last[0] >= 1 / C.TARGET_FPS:
+            last[0] = elapsed
+            results.put(('progress', explored, elapsed))
+        return not requests.empty()
+
+    try:
+        if memory_limit:
+            size = memory_limit * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+
+        level = Level(None, filename)
+        level.load(levelnum)
+        level.restore_state(state)
+
+        if task == 'all':
+            result = level.solve_all_boxes(progress=progress, **options)
+        elif task == 'one':
+            result = level.solve_one_box(*args, progress=progress, **options)
+        else:
+            result = level.move_one_box(*args, progress=progress, **options)
+        found, message, path = result
+        search = level.search
+        if search is not None:
+            stats[:] = search.explored, search.elapsed
+            search = search.stats.as_dict()
+        results.put(('done', bool(found), message, path) + tuple(stats)
+                    + (search,))
+    except Exception as e:
+        results.put(('done', False, "Erreur : " + repr(e), None)
+                    + tuple(stats) + (None,))
+
+
+class BackgroundSolver:
+    """
+    Solving task running in a worker process, with at most 'memory_limit'
+    megabytes if given.
+    """
+
+    def __init__(self, level, levelnum, task, *args, memory_limit=None,
+                 **options):
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.result = None
+        # explored states and elapsed time, when the result is known,
+        # with all the statistics of the search (see SearchStats.as_dict)
+        # if there was one
+        self.stats = None
+        self.search_stats = None
+        self.process = context.Process(
+            target=solve_task,
+            args=(level.filename, levelnum, level.get_current_state(),
+                  task, args, options, memory_limit,
+                  self.requests, self.results),
+            daemon=True)
+        self.process.start()
+
+    def cancel(self):
+        self.requests.put('cancel')
+
+    def poll(self):
+        """
+        Read what the worker has sent, without waiting.
+        Return the last progress (explored states, elapsed time) received,
+        or None. The result (found, message, path) is stored in 'result'
+        when the search is over.
+        """
+        progress = None
+        alive = self.process.is_alive()
+        while self.result is None:
+            try:
+                msg = self.results.get_nowait()
+            except queue.Empty:
+                if not alive:
+                    # stopped without any result
+                    self.result = (False, "Erreur dans le calcul", None)
+                    self.stats = (0, 0)
+                break
+            if msg[0] == 'progress':
+                progress = msg[1:]
+            else:
+                self.result = msg[1:4]
+                self.stats = msg[4:6]
+                self.search_stats = msg[6]
+        return progress
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
@@ -0,0 +1,301 @@
+"""
+Headless solving of whole level packs, without any window.
+Levels are spread over all cores with a pool of processes, each of them
+with a time and a memory limit, and the solutions are written with some
+statistics to a JSON or CSV file.
+Solutions can also be added to the solution cache, so that the game finds
+them immediately.
+In portfolio mode, levels are solved one after the other, each of them by
+several configurations of the solver racing on all cores.
+"""
+
+import csv
+import json
+import os
+import resource
+import signal
+from time import time, sleep
+from multiprocessing import Pool
+from level import Level
+from explore import ENGINES, MODES, OPTIMAL_MODES, Budget, BUDGET_NAMES, \
+    solution_task
+from portfolio import PortfolioSolver, mode_configs
+import patterns
+import solution_cache
+
+# seconds given to a search after its time limit, before it is stopped
+# anyway: the limit is only checked between two expanded states, that can
+# be very long to expand with hundreds of boxes
+GRACE = 5
+
+# status of a level when a limit of its budget is exceeded
+BUDGET_STATUS = {'time': 'timeout', 'nodes': 'nodes', 'memory': 'memory'}
+
+# fields of a level result, also the columns of a CSV output
+FIELDS = ['level', 'title', 'status', 'pushes', 'moves',
+          'explored', 'elapsed', 'speed', 'config', 'solution']
+
+
+def limit_memory(megabytes):
+    """
+    Pool initializer: cap the memory of a worker process, so that a search
+    running out of memory fails with MemoryError instead of slowing down
+    the whole machine.
+    """
+    if megabytes:
+        size = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+
+
+def solve_level(task):
+    """
+    Solve one level of a pack, in a worker process.
+    """
+    (pack, num, time_limit, node_limit, bidirectional, engine, mode,
+     checkpoint) = task
+
+    result = dict.fromkeys(FIELDS)
+    result['level'] = num
+
+    # the memory is limited by the pool already, the search stops cleanly
+    # with its statistics on MemoryError
+    budget = Budget(time_limit, node_limit)
+
+    def alarm(signum, frame):
+        raise TimeoutError()
+
+    if time_limit is not None:
+        signal.signal(signal.SIGALRM, alarm)
+        signal.alarm(int(time_limit) + GRACE)
+
+    try:
+        level = Level(None, pack)
+        level.load(num)
+        result['title'] = level.title
+        key = level.solution_key(solution_task(mode))
+
+        bs = ENGINES[engine](level, level.boxes, budget=budget,
+                             bidirectional=bidirectional, mode=mode,
+                             checkpoint=checkpoint)
+        found, message, path = bs.solve()
+        signal.alarm(0)
+    except MemoryError:
+        result['status'] = 'memory'
+        return result
+    except TimeoutError:
+        result['status'] = 'timeout'
+        return result
+    except Exception as e:
+        # keep going with other levels
+        print("Error on level", num, ":", repr(e))
+        result['status'] = 'error'
+        return result
+
+    record(result, level, key, found, path, bs.explored, bs.elapsed)
+    # not one of the fields either, only written to JSON outputs
+    result['stats'] = bs.stats.as_dict()
+    if not found:
+        if bs.stats.exceeded is not None:
+            result['status'] = BUDGET_STATUS[bs.stats.exceeded]
+        else:
+            result['status'] = 'unsolvable'
+    return result
+
+
+def budget_status(message):
+    """
+    Status of a level from the message of a search over its budget, or None.
+    """
+    for limit, name in BUDGET_NAMES.items():
+        if message.startswith("Budget dépassé (" + name + ")"):
+            return BUDGET_STATUS[limit]
+    return None
+
+
+def solve_level_portfolio(pack, num, time_limit, node_limit, memory_limit,
+                          mode, configs):
+    """
+    Solve one level of a pack with all configurations racing in search mode
+    'mode', in the main process.
+    """
+    result = dict.fromkeys(FIELDS)
+    result['level'] = num
+
+    level = Level(None, pack)
+    level.load(num)
+    result['title'] = level.title
+    key = level.solution_key(solution_task(mode))
+
+    # actual searches, to compare the configurations
+    solver = PortfolioSolver(level, num, configs, memory_limit, cached=False,
+                             budget=Budget(nodes=node_limit))
+    start = time()
+    cancelled = False
+    while solver.result is None:
+        sleep(0.05)
+        solver.poll()
+        if not cancelled and time_limit is not None \
+                and time() - start > time_limit:
+            solver.cancel()
+            cancelled = True
+    solver.stop()
+
+    found, message, path = solver.result
+    record(result, level, key, found, path, *solver.stats)
+    if solver.search_stats is not None:
+        result['stats'] = solver.search_stats
+    result['config'] = solver.winner if found else None
+    if not found:
+        if cancelled:
+            result['status'] = 'timeout'
+        elif budget_status(message) is not None:
+            result['status'] = budget_status(message)
+        elif message.startswith("Erreur"):
+            result['status'] = 'error'
+        else:
+            result['status'] = 'unsolvable'
+    return result
+
+
+def record(result, level, key, found, path, explored, elapsed):
+    """
+    Fill 'result' with the statistics of a search, and with its solution
+    if found.
+    """
+    result['explored'] = explored
+    result['elapsed'] = round(elapsed, 3)
+    if elapsed > 0:
+        result['speed'] = round(explored / elapsed, 1)
+
+    if found:
+        result['status'] = 'solved'
+        result['pushes'] = len(path)
+        result['solution'] = level.solution_moves(path)
+        result['moves'] = len(result['solution'])
+        # not one of the fields, taken back by the main process
+        result['cache'] = (key, level.cache_entry(path, result['solution']))
+
+
+def write_results(results, output, info):
+    """
+    Write the results to 'output', as CSV if its extension is .csv,
+    as JSON otherwise, with 'info' describing the run and the statistics
+    of each search.
+    """
+    if output.endswith('.csv'):
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        data = dict(info)
+        data['levels'] = results
+        with open(output, 'w') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def solve_pack(pack, output, time_limit=60, memory_limit=1024, jobs=None,
+               bidirectional=False, engine='astar', mode='weighted',
+               warm_cache=False, portfolio=False, node_limit=None,
+               checkpoint_dir=None):
+    """
+    Solve all levels of 'pack' using 'jobs' processes (all cores by
+    default), with a time limit in seconds, a memory limit in megabytes and
+    a limit of expanded states (none by default) per level, with the search
+    engine named 'engine' in search mode 'mode', searching backward as well
+    if 'bidirectional' is set.
+    Solutions are added to the solution cache if 'warm_cache' is set.
+    With 'portfolio', levels are solved one at a time by the first 'jobs'
+    configurations of the portfolio (all of them by default) instead.
+    Searches are saved from time to time in 'checkpoint_dir' if given, and
+    resumed from there when the pack is solved again.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown search engine: " + engine)
+    if mode not in MODES:
+        raise ValueError("Unknown search mode: " + mode)
+    if bidirectional and engine == 'ida':
+        raise ValueError("No bidirectional iterative deepening")
+    if mode == 'greedy' and engine == 'ida':
+        raise ValueError("No greedy iterative deepening")
+    if bidirectional and mode in OPTIMAL_MODES:
+        raise ValueError("No optimal bidirectional search")
+    if checkpoint_dir is not None and (portfolio or engine != 'astar'):
+        raise ValueError("Checkpoints need the astar engine")
+    num_levels = Level(None, pack).num_levels()
+
+    # loaded (or computed) once, before the workers are started
+    patterns.get_database()
+
+    checkpoints = [None] * (num_levels+1)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(pack))[0]
+        checkpoints = [os.path.join(checkpoint_dir,
+                                    "{}_{}.ckpt".format(name, num))
+                       for num in range(num_levels+1)]
+
+    tasks = [(pack, num, time_limit, node_limit, bidirectional, engine, mode,
+              checkpoints[num])
+             for num in range(1, num_levels+1)]
+
+    pool = None
+    if portfolio:
+        # workers of a pool cannot start processes of their own
+        configs = mode_configs(mode)[:jobs]
+        solved_levels = (solve_level_portfolio(pack, num, time_limit,
+                                               node_limit, memory_limit,
+                                               mode, configs)
+                         for num in range(1, num_levels+1))
+    else:
+        pool = Pool(jobs, initializer=limit_memory, initargs=(memory_limit,),
+                    maxtasksperchild=1)
+        solved_levels = pool.imap_unordered(solve_level, tasks)
+
+    results = []
+    cache = solution_cache.get_cache() if warm_cache else None
+    for r in solved_levels:
+        entry = r.pop('cache', None)
+        if cache is not None and entry is not None:
+            key, (path, moves) = entry
+            cache.put(key, path, moves, save=False)
+        results.append(r)
+        print("[{}/{}] level {}: {} ({} states, {}s{})".format(
+            len(results), num_levels, r['level'], r['status'],
+            r['explored'], r['elapsed'],
+            ", " + r['config'] if r['config'] else ""))
+    if pool is not None:
+        pool.terminate()
+
+    if cache is not None:
+        cache.save()
+
+    results.sort(key=lambda r: r['level'])
+    solved = sum(1 for r in results if r['status'] == 'solved')
+    print("Solved {} out of {} levels".format(solved, num_levels))
+
+    # levels solved first by each configuration of the portfolio
+    wins = {}
+    for r in results:
+        if r['status'] == 'solved' and r['config'] is not None:
+            wins[r['config']] = wins.get(r['config'], 0) + 1
+    if wins:
+        print("Solved first by:", ", ".join(
+            "{} {}".format(name, n) for name, n in wins.items()))
+
+    info = {
+        'pack': pack,
+        'time_limit': time_limit,
+        'memory_limit': memory_limit,
+        'node_limit': node_limit,
+        'bidirectional': bidirectional,
+        'engine': engine,
+        'mode': mode,
+        'portfolio': portfolio,
+        'wins': wins,
+        'solved': solved,
+    }
+    write_results(results, output, info)
+    print("Results written to", output)
+    return results
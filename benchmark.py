@@ -0,0 +1,197 @@
+"""
+Benchmark of the solver over the Large Test Suite Sets.
+A fixed subset of levels is solved with a limit of expanded states, and
+the results are compared to a baseline file to spot regressions from one
+version of the solver to the next.
+Only the solved levels and their numbers of explored states, which do not
+depend on the machine nor on its load, are checked for regressions. Times
+vary from one run to the next, they are only reported: the time limit is
+only there in case a search gets stuck, far above what the limit of states
+needs.
+"""
+
+import os
+import json
+from time import time
+from multiprocessing import Pool
+from level import Level
+from explore import ENGINES, MODES, OPTIMAL_MODES
+import batch
+import patterns
+
+SUITE = 'Large Test Suite Sets'
+
+# levels taken from each collection
+PER_PACK = 5
+
+BASELINE = os.path.join('assets', 'benchmark.json')
+
+# expanded states per level, which decide whether a level is solved
+NODE_LIMIT = 10000
+# seconds per level, the slowest levels need about a minute for NODE_LIMIT
+TIME_LIMIT = 300
+
+# relative increase of explored states reported as a regression
+TOLERANCE = 0.2
+# relative change of time reported, for information only
+TIME_TOLERANCE = 0.2
+# times below this (in seconds) are too short to be compared
+MIN_TIME = 1
+
+
+def select_levels(per_pack=PER_PACK):
+    """
+    Fixed subset of the Large Test Suite Sets: in each collection,
+    'per_pack' levels evenly spread from the first to the last one, as
+    collections usually go from easy to hard levels.
+    Return a list of (pack, level number).
+    """
+    levels = []
+    for name in sorted(os.listdir(os.path.join('assets', 'levels', SUITE))):
+        if not name.endswith('.xsb'):
+            continue
+        pack = os.path.join(SUITE, name)
+        count = Level(None, pack).num_levels()
+        if count <= per_pack:
+            nums = range(1, count+1)
+        else:
+            nums = sorted({1 + k*(count-1) // (per_pack-1)
+                           for k in range(per_pack)})
+        levels += [(pack, num) for num in nums]
+    return levels
+
+
+def bench_level(task):
+    """
+    Solve one level as the batch solver does, also measuring the wall time
+    with the loading of the level.
+    """
+    start = time()
+    result = batch.solve_level(task)
+    result['wall'] = round(time() - start, 3)
+    return result
+
+
+def compare(results, baseline):
+    """
+    Compare results to the baseline, both by level key.
+    Return the list of regressions, the list of improvements and the list
+    of changes of time, as messages. Times are not regressions, as they
+    vary too much from one run to the next.
+    """
+    regressions = []
+    improvements = []
+    timings = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        was_solved = old['status'] == 'solved'
+        solved = new['status'] == 'solved'
+        if was_solved and not solved:
+            regressions.append("{}: no longer solved ({})".format(
+                key, new['status']))
+        elif solved and not was_solved:
+            improvements.append("{}: now solved".format(key))
+        elif solved:
+            if new['explored'] > old['explored'] * (1 + TOLERANCE):
+                regressions.append("{}: {} states instead of {}".format(
+                    key, new['explored'], old['explored']))
+            elif new['explored'] < old['explored'] * (1 - TOLERANCE):
+                improvements.append("{}: {} states instead of {}".format(
+                    key, new['explored'], old['explored']))
+            if max(new['wall'], old['wall']) > MIN_TIME \
+                    and abs(new['wall'] - old['wall']) \
+                    > old['wall'] * TIME_TOLERANCE:
+                timings.append("{}: {}s instead of {}s".format(
+                    key, new['wall'], old['wall']))
+    return regressions, improvements, timings
+
+
+def run_benchmark(baseline=BASELINE, save_baseline=False,
+                  time_limit=TIME_LIMIT, memory_limit=1024, jobs=None,
+                  bidirectional=False, engine='astar', mode='weighted',
+                  per_pack=PER_PACK, node_limit=NODE_LIMIT):
+    """
+    Solve the benchmark levels, and compare the results to the file
+    'baseline', or replace it if 'save_baseline' is set.
+    Other arguments are as for batch.solve_pack; 'jobs' changes the times
+    measured, it should be the same as for the baseline.
+    Return the number of regressions found.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown search engine: " + engine)
+    if mode not in MODES:
+        raise ValueError("Unknown search mode: " + mode)
+    if bidirectional and engine == 'ida':
+        raise ValueError("No bidirectional iterative deepening")
+    if mode == 'greedy' and engine == 'ida':
+        raise ValueError("No greedy iterative deepening")
+    if bidirectional and mode in OPTIMAL_MODES:
+        raise ValueError("No optimal bidirectional search")
+    patterns.get_database()
+
+    levels = select_levels(per_pack)
+    tasks = [(pack, num, time_limit, node_limit, bidirectional, engine,
+              mode, None) for pack, num in levels]
+
+    results = {}
+    with Pool(jobs, initializer=batch.limit_memory,
+              initargs=(memory_limit,), maxtasksperchild=1) as pool:
+        for (pack, num), r in zip(levels, pool.imap(bench_level, tasks)):
+            key = "{}:{}".format(os.path.basename(pack), num)
+            results[key] = {k: r[k] for k in
+                            ('status', 'pushes', 'moves', 'explored',
+                             'elapsed', 'wall')}
+            print("[{}/{}] {}: {} ({} states, {}s)".format(
+                len(results), len(levels), key, r['status'],
+                r['explored'], r['wall']))
+
+    solved = sum(1 for r in results.values() if r['status'] == 'solved')
+    wall = sum(r['wall'] for r in results.values())
+    print("Solved {} out of {} levels in {:.1f}s".format(
+        solved, len(levels), wall))
+
+    info = {
+        'time_limit': time_limit,
+        'memory_limit': memory_limit,
+        'node_limit': node_limit,
+        'jobs': jobs,
+        'bidirectional': bidirectional,
+        'engine': engine,
+        'mode': mode,
+        'per_pack': per_pack,
+        'solved': solved,
+    }
+
+    if save_baseline:
+        data = dict(info)
+        data['levels'] = results
+        with open(baseline, 'w') as f:
+            json.dump(data, f, indent=4)
+        print("Baseline written to", baseline)
+        return 0
+
+    try:
+        with open(baseline) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        print("No baseline in", baseline)
+        return 0
+
+    for k, v in info.items():
+        if k != 'solved' and data.get(k) != v:
+            print("Warning: baseline computed with {} = {}".format(
+                k, data.get(k)))
+
+    regressions, improvements, timings = compare(results, data['levels'])
+    print("Baseline: {} solved, now {}".format(data['solved'], solved))
+    for msg in timings:
+        print("  time:", msg)
+    for msg in improvements:
+        print("  better:", msg)
+    for msg in regressions:
+        print("  REGRESSION:", msg)
+    if not regressions:
+        print("No regression")
+    return len(regressions)
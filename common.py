@@ -74,6 +74,28 @@ TARGETOVER      = 9 # just for the texture overlay
 
 SYMBOLS_ORIGINALS = ['','#','$','.','*','@',' ','','+']
 
+# Bit flags of the cells of a level board
+CELL_WALL   = 1
+CELL_FLOOR  = 2
+CELL_TARGET = 4
+CELL_BOX    = 8
+
+# flags of the cell of each block read in a level file
+BLOCK_FLAGS = {
+    WALL: CELL_WALL,
+    BOX: CELL_FLOOR | CELL_BOX,
+    TARGET: CELL_FLOOR | CELL_TARGET,
+    TARGET_FILLED: CELL_FLOOR | CELL_TARGET | CELL_BOX,
+    PLAYER: CELL_FLOOR,
+    AIR: 0,
+    GROUND: CELL_FLOOR,
+    PLAYER_ON_TARGET: CELL_FLOOR | CELL_TARGET,
+}
+
+# directory where levels are also kept once parsed and analysed (see
+# compiled_level), None to keep them only in memory
+LEVEL_CACHE_DIR = None
+
 UP      = 0
 DOWN    = 1
 LEFT    = 2
@@ -93,6 +115,9 @@ DIRS = [(0, -1),  # up
 
 DNAMES = ["up","down","left","right"]
 
+# LURD notation of moves, uppercase when pushing a box
+LURD = "udlr"
+
 # Colors
 WHITE           = (255,255,255)
 BLACK           = (0,0,0)
@@ -115,6 +140,35 @@ SOLVE_DELAY = 100 # milliseconds
 FLASH_DELAY = 100 # milliseconds
 
 
+# Deadlock detection budgets, so that checks after each push stay cheap:
+# number of boxes examined when checking if a box is frozen
+FREEZE_BUDGET = 64
+# number of tiles explored when checking if an area is closed off
+CORRAL_BUDGET = 64
+
+# largest area behind an entrance considered as a goal room
+ROOM_SIZE = 64
+
+# number of states remembered by the iterative-deepening solver
+TABLE_SIZE = 1 << 18
+
+# seconds between two checkpoints of a search, when it has a checkpoint file
+CHECKPOINT_INTERVAL = 60
+
+# solve whole levels with several configurations racing in parallel
+PORTFOLIO = False
+
+# search mode to solve whole levels: 'weighted', 'greedy', or optimal in
+# 'pushes' or 'moves'
+SOLVE_MODE = 'weighted'
+
+# budget of the searches started in the game: seconds, expanded states and
+# megabytes of the worker process, None for no limit
+SOLVE_TIME_BUDGET = None
+SOLVE_NODE_BUDGET = None
+SOLVE_MEMORY_BUDGET = None
+
+
 # number of identical successive frames for animations
 FRAMES_PER_ANIM = 6
 
@@ -0,0 +1,159 @@
+"""
+Levels once parsed and analysed: flat board with the interior floor marked,
+targets, initial boxes and player, interior cells and dead cells.
+Restarting a level, or coming back to it, then only copies the compiled
+level instead of reading, parsing and analysing it again.
+Compiled levels are kept in memory by pack and level number, and also on
+disk in C.LEVEL_CACHE_DIR if it is set.
+"""
+
+import os
+import sys
+import struct
+from array import array
+import common as C
+
+MAGIC = b'SOKL'
+VERSION = 1
+
+# modification time and size of the pack, sizes of the board and the
+# number of boxes and targets, player cell, length of the title (-1 if
+# there is none) and 1 if there are dead cells
+HEADER = struct.Struct('<qqHHHHiiB')
+
+# global variable, as for scores: compiled levels by pack and level number
+levels = {}
+
+
+class CompiledLevel:
+    """
+    Content of a level as loaded, never modified afterwards but for its
+    analysis, added the first time it is loaded: board, interior and dead
+    are bytes for each cell of the flat board, boxes and targets are
+    positions.
+    'dead' is None if the dead cells were not computed.
+    """
+
+    def __init__(self, title, width, height, board, boxes, targets, player,
+                 interior, dead):
+        self.title = title
+        self.width = width
+        self.height = height
+        self.board = bytes(board)
+        self.boxes = tuple(boxes)
+        self.targets = tuple(targets)
+        self.player = player
+        self.interior = bytes(interior)
+        self.dead = None if dead is None else bytes(dead)
+        # structures derived from the level by Level.analyse, only kept in
+        # memory
+        self.analysis = None
+
+
+def cache_key(pack, levelnum):
+    return (pack.path, pack.mtime, pack.size, levelnum)
+
+
+def cache_file(pack, levelnum):
+    # as checkpoint files, from the name of the pack and the level number
+    name = "{}_{}.lvl".format(os.path.basename(pack.path), levelnum)
+    return os.path.join(C.LEVEL_CACHE_DIR, name)
+
+
+def get(pack, levelnum):
+    """
+    Compiled level 'levelnum' of 'pack' (see pack_index), or None if it
+    was not compiled yet or the pack has changed since.
+    """
+    key = cache_key(pack, levelnum)
+    level = levels.get(key)
+    if level is None and C.LEVEL_CACHE_DIR is not None:
+        level = load(cache_file(pack, levelnum), pack)
+        if level is not None:
+            levels[key] = level
+    return level
+
+
+def put(pack, levelnum, level):
+    levels[cache_key(pack, levelnum)] = level
+    if C.LEVEL_CACHE_DIR is not None:
+        save(cache_file(pack, levelnum), pack, level)
+
+
+def to_cells(width, positions):
+    return array('i', (x + y*width for x, y in positions))
+
+
+def to_positions(width, cells):
+    return [(i % width, i // width) for i in cells]
+
+
+def save(filename, pack, level):
+    title = b'' if level.title is None else level.title.encode()
+    boxes = to_cells(level.width, level.boxes)
+    targets = to_cells(level.width, level.targets)
+    player, = to_cells(level.width, [level.player])
+    if sys.byteorder == 'big':
+        boxes.byteswap()
+        targets.byteswap()
+
+    # written aside then renamed, not to leave a truncated file
+    tmp = filename + '.' + str(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + bytes([VERSION]))
+            f.write(HEADER.pack(
+                pack.mtime, pack.size, level.width, level.height,
+                len(boxes), len(targets), player,
+                -1 if level.title is None else len(title),
+                level.dead is not None))
+            f.write(title)
+            f.write(level.board)
+            f.write(level.interior)
+            if level.dead is not None:
+                f.write(level.dead)
+            boxes.tofile(f)
+            targets.tofile(f)
+        os.replace(tmp, filename)
+    except OSError as e:
+        print("Cannot save compiled level:", e)
+
+
+def load(filename, pack):
+    """
+    Read the level compiled in 'filename', if it is still the one of the
+    pack. Return None if it has to be compiled again.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC) + 1) != MAGIC + bytes([VERSION]):
+                return None
+            mtime, size, width, height, nboxes, ntargets, player, \
+                title_len, has_dead = HEADER.unpack(f.read(HEADER.size))
+            if mtime != pack.mtime or size != pack.size:
+                return None
+            title = None
+            if title_len >= 0:
+                title = f.read(title_len).decode()
+            cells = width * height
+            board = f.read(cells)
+            interior = f.read(cells)
+            dead = f.read(cells) if has_dead else None
+            if len(board) != cells or len(interior) != cells \
+                    or dead is not None and len(dead) != cells:
+                return None
+            boxes = array('i')
+            boxes.fromfile(f, nboxes)
+            targets = array('i')
+            targets.fromfile(f, ntargets)
+    except (OSError, EOFError, struct.error, UnicodeDecodeError):
+        return None
+    if sys.byteorder == 'big':
+        boxes.byteswap()
+        targets.byteswap()
+
+    player, = to_positions(width, [player])
+    return CompiledLevel(title, width, height, board,
+                         to_positions(width, boxes),
+                         to_positions(width, targets), player, interior, dead)
@@ -9,8 +9,15 @@ import common as C
 from utils import *
 import queue
 import heapq
+import json
+import os
+import pickle
+import resource
+import sys
+import zlib
+from array import array
+from collections import OrderedDict
 from time import time
-from math import sqrt
 
 
 class DFS:
@@ -23,115 +30,181 @@ class DFS:
         self.level = level
 
     def search_floor(self, source):
-        init_x, init_y = source
+        """
+        Mark the cells of the flat board of the level that the player can
+        walk to from position 'source', ignoring boxes.
+        """
+        board = self.level.board
+        offsets = self.level.offsets
 
         # to remember which tiles have been visited or not
-        mark = [[False for x in range(self.level.width)]
-                for y in range(self.level.height)]
+        mark = bytearray(len(board))
 
-        def rec_explore(position):
-            x, y = position
-            if mark[y][x]:
-                return
+        # explicit stack rather than recursion, for large levels
+        stack = [self.level.index(source)]
+        while stack:
+            i = stack.pop()
+            if mark[i]:
+                continue
 
             # mark current position as visited
-            mark[y][x] = True
+            mark[i] = 1
 
-            for d, (mx, my) in enumerate(C.DIRS):
-                if self.level.is_wall((x+mx, y+my)):
+            for o in offsets:
+                if board[i+o] & C.CELL_WALL:
                     continue
 
-                rec_explore((x+mx, y+my))
+                stack.append(i+o)
 
-        rec_explore(source)
         return mark
 
 
 # START_CUT
-class Dijkstra:
+class Reach:
+    """
+    Tiles attainable by the player without pushing any box.
+    Works on the flat neighbour table of the level, with cells numbered over
+    the interior floor.
+    Buffers are reused from one search to the next: a cell is marked when
+    its stamp equals the current generation, so a new search only has to
+    increment the generation instead of clearing the marks.
+    """
+
     def __init__(self, level):
         self.level = level
-        self.marks = None
-        self.preds = None
-        self.att_list = None
-        self.dist = None
-
-    def attainable(self, source, boxes_block=True):
-        init_x, init_y = source
-
-        allowed = [C.GROUND, C.TARGET, C.AIR]
-
-        fifo = queue.Queue()
-        fifo.put(source)
-
-        mark = [[False for x in range(self.level.width)]
-                for y in range(self.level.height)]
-        pred = [[None for x in range(self.level.width)]
-                for y in range(self.level.height)]
-        dist = [[-1 for x in range(self.level.width)]
-                for y in range(self.level.height)]
-        mark[init_y][init_x] = True
-
-        dist[init_y][init_x] = 0
-
-        att = [source]
+        self.nbr = level.neighbours
+        n = len(level.floor)
+        self.occupied = bytearray(n)  # cells with a box
+        self.stamp = [0] * n
+        self.dist = [0] * n
+        self.pred = [0] * n  # direction used to reach a cell
+        self.gen = 0
+        self.cells = []  # attainable cells, in order of discovery
+        self.source = -1
+        self.top = -1  # top-left attainable cell (smallest index)
+        self.has_dist = False
+
+    def load_boxes(self, boxes):
+        """
+        Place boxes on cells 'boxes' (numbered over the interior floor),
+        and only there.
+        """
+        occ = self.occupied
+        occ[:] = bytes(len(occ))
+        for i in boxes:
+            occ[i] = 1
 
-        while not fifo.empty():
-            x, y = fifo.get()
-            curdist = dist[y][x]
+    def is_marked(self, i):
+        return self.stamp[i] == self.gen
 
-            for d, (mx, my) in enumerate(C.DIRS):
-                # print ('verbose y:', y+my, 'x:', x+mx)
-                if mark[y+my][x+mx]:
+    def flood(self, source):
+        """
+        Breadth-first search from cell 'source', computing the attainable
+        cells with their distance and predecessor.
+        """
+        self.gen += 1
+        gen = self.gen
+        nbr = self.nbr
+        occ = self.occupied
+        stamp = self.stamp
+        dist = self.dist
+        pred = self.pred
+
+        stamp[source] = gen
+        dist[source] = 0
+        top = source
+        cells = [source]
+        # cells is the fifo: iteration goes on with cells appended meanwhile
+        for c in cells:
+            nd = dist[c] + 1
+            for d in range(C.NUMDIRS):
+                n = nbr[4*c+d]
+                if n < 0 or stamp[n] == gen or occ[n]:
                     continue
-
-                if self.level.map[y+my][x+mx] not in allowed \
-                        or boxes_block and self.level.has_box((x+mx, y+my)):
+                stamp[n] = gen
+                dist[n] = nd
+                pred[n] = d
+                cells.append(n)
+                if n < top:
+                    top = n
+
+        self.cells = cells
+        self.source = source
+        self.top = top
+        self.has_dist = True
+        return cells
+
+    def push(self, box, dest):
+        """
+        Update the attainable cells after the box on cell 'box' has been
+        pushed to cell 'dest', the player now standing on 'box'.
+        If 'dest' was not attainable, the area can only grow, so it is just
+        extended from 'box', and what is needed to undo the push is
+        returned. Otherwise, everything is recomputed and None is returned.
+        Distances are not valid anymore after an incremental update.
+        """
+        occ = self.occupied
+        occ[box] = 0
+        occ[dest] = 1
+
+        gen = self.gen
+        stamp = self.stamp
+        if stamp[dest] == gen:
+            self.flood(box)
+            return None
+
+        nbr = self.nbr
+        top = self.top
+        undo = (box, dest, top, self.has_dist)
+        added = []
+        if stamp[box] != gen:
+            stamp[box] = gen
+            added.append(box)
+            top = min(top, box)
+        for c in added:
+            for d in range(C.NUMDIRS):
+                n = nbr[4*c+d]
+                if n < 0 or stamp[n] == gen or occ[n]:
                     continue
+                stamp[n] = gen
+                added.append(n)
+                if n < top:
+                    top = n
 
-                mark[y+my][x+mx] = True
-                dist[y+my][x+mx] = curdist+1
-
-                att.append((x+mx, y+my))
-                fifo.put((x+mx, y+my))
-                pred[y+my][x+mx] = ((x, y), (mx, my), d)
-
-        self.marks = mark
-        self.att_list = att
-        self.preds = pred
-        self.dist = dist
+        self.cells += added
+        self.top = top
+        self.has_dist = False
+        return undo + (added,)
 
-        return att
-
-    def is_marked(self, pos):
-        x, y = pos
-        return self.marks[y][x]
-
-    def get_marks(self):
-        return self.marks
-
-    def distance(self, target):
-        x, y = target
-        d = self.dist[y][x]
-        assert(d != -1)
-        return d
-
-    def show_distances(self):
-        for row in self.dist:
-            print(row)
-
-    def shortest_path(self, source, dest):
-        assert (self.marks)
+    def undo_push(self, undo):
+        """
+        Undo an incremental push.
+        """
+        box, dest, top, has_dist, added = undo
+        occ = self.occupied
+        occ[box] = 1
+        occ[dest] = 0
+        stamp = self.stamp
+        for c in added:
+            stamp[c] = 0
+        if added:
+            del self.cells[-len(added):]
+        self.top = top
+        self.has_dist = has_dist
+
+    def shortest_path(self, dest):
+        """
+        Directions to follow from the source of the last search to 'dest'.
+        """
+        assert (self.has_dist and self.is_marked(dest))
         path = []
         current = dest
-        verbose('source:', source, 'dest:', dest)
-        while current != source:
-            x, y = current
-            verbose('path:', current)
-            current, move, direct = self.preds[y][x]
-            path.append(direct)
+        while current != self.source:
+            d = self.pred[current]
+            path.append(d)
+            current = self.nbr[4*current+opposite(d)]
 
-        return reversed(path)
+        return list(reversed(path))
 
 
 MSG_SOLVE = "Explorés: {exp}     Temps: {el:.2f}s     Vitesse: {sp:.2f} états/s"
@@ -147,116 +220,682 @@ class Deadlocks:
         self.level = level
 
     def compute(self):
+        """
+        Return the dead tiles, as a flag for each cell of the flat board of
+        the level.
+        """
+        board = self.level.board
 
         # will mark as "reverse-attainable" tiles
         # consider all tiles as dead, then unmark them if they are
         # reversed-attainable
-        dead = [[True for x in range(self.level.width)]
-                for y in range(self.level.height)]
+        dead = bytearray(b'\x01') * len(board)
 
         # lifo would just do also fine here
         fifo = queue.Queue()
         for t in self.level.targets:
-            fifo.put(t)
-            x, y = t
-            dead[y][x] = False
+            i = self.level.index(t)
+            fifo.put(i)
+            dead[i] = 0
 
         while not fifo.empty():
             t = fifo.get()
 
             # check all neighbours
-            for d in range(C.NUMDIRS):
-                n = in_dir(t, d)
-                x, y = n
-                if self.level.is_wall(n):
+            for o in self.level.offsets:
+                n = t + o
+                if board[n] & C.CELL_WALL:
                     continue
-                if not dead[y][x]:
+                if not dead[n]:
                     continue  # already visited
-                n2 = in_dir(t, d, dist=2)
-                if self.level.is_wall(n2):
+                n2 = n + o
+                if board[n2] & C.CELL_WALL:
                     continue
 
                 # otherwise, possible to push a box from n using n2
                 fifo.put(n)
-                dead[y][x] = False
+                dead[n] = 0
 
         # now unmarked tiles are deadlocks
         self.dead = dead
         return dead
 
 
+# distance of a cell from where no target can be reached
+INF = 1 << 20
+
+# weight of the heuristic in A*: it counts pushes while the cost of a state
+# counts all moves, weighting it makes the search go much more directly to
+# a solution, at most WEIGHT times longer than the shortest one
+WEIGHT = 10
+
+# search modes: weighted A* on moves (quick, near-optimal solutions),
+# greedy on the heuristic only (quicker, longer solutions), or A* giving
+# solutions with the fewest pushes, or the fewest moves
+MODES = ('weighted', 'greedy', 'pushes', 'moves')
+OPTIMAL_MODES = ('pushes', 'moves')
+
+# format of the checkpoint files, older ones are not resumed
+CHECKPOINT_VERSION = 2
+
+
+def solution_task(mode):
+    """
+    Task of a solution of the whole level in the solution cache: optimal
+    solutions are kept apart, other modes share their solutions.
+    """
+    if mode in OPTIMAL_MODES:
+        return 'all-' + mode
+    return 'all'
+
+
+class PushDistances:
+    """
+    Minimal number of pushes to bring a box from any interior cell to each
+    target, as if there were no other box, and ignoring whether the player
+    can go behind the box.
+    Computed with a reverse search from the target, pulling the box: this
+    respects walls, and a box is pushed only if there is room for the
+    player behind it.
+    """
+
+    def __init__(self, level):
+        self.level = level
+
+    def from_target(self, target):
+        """
+        Distances (indexed by floor cells) from all cells to cell 'target'.
+        """
+        nbr = self.level.neighbours
+        dist = [INF] * len(self.level.floor)
+        dist[target] = 0
+        cells = [target]
+        for b in cells:
+            nd = dist[b] + 1
+            for d in range(C.NUMDIRS):
+                # pulling the box from b to n, player going to n2
+                n = nbr[4*b+d]
+                if n < 0 or dist[n] != INF:
+                    continue
+                n2 = nbr[4*n+d]
+                if n2 < 0:
+                    continue
+                dist[n] = nd
+                cells.append(n)
+        return dist
+
+    def from_box(self, source):
+        """
+        Distances (indexed by floor cells) from cell 'source' to all cells,
+        pushing the box forward.
+        """
+        nbr = self.level.neighbours
+        dist = [INF] * len(self.level.floor)
+        dist[source] = 0
+        cells = [source]
+        for b in cells:
+            nd = dist[b] + 1
+            for d in range(C.NUMDIRS):
+                # pushing the box from b to n, player coming from the
+                # opposite side
+                n = nbr[4*b+d]
+                if n < 0 or dist[n] != INF:
+                    continue
+                if nbr[4*b+opposite(d)] < 0:
+                    continue
+                dist[n] = nd
+                cells.append(n)
+        return dist
+
+    def compute(self):
+        """
+        Table of distances: for each floor cell, the list of distances to
+        each target, in the order of level.targets.
+        """
+        fi = self.level.floor_index
+        per_target = [self.from_target(fi[t]) for t in self.level.targets]
+        self.table = [list(row) for row in zip(*per_target)]
+        return self.table
+
+
+class Macros:
+    """
+    Structure of the level for macro pushes, pushing a box several times
+    in a single step of the search:
+    - tunnels: one-wide corridors, where the player can only follow the
+      box it pushes
+    - goal rooms: areas with targets and a single entrance, where boxes
+      are pushed straight to the next target in a fixed filling order
+    Cells are numbered over the interior floor.
+    """
+
+    def __init__(self, level):
+        self.level = level
+
+    def compute(self):
+        self.compute_tunnels()
+        self.compute_rooms()
+        return self
+
+    def compute_tunnels(self):
+        """
+        tunnel[4*i+d] tells if there are walls on both sides of cell i
+        for a move in direction d.
+        """
+        nbr = self.level.neighbours
+        self.tunnel = []
+        for i in range(len(self.level.floor)):
+            for d in range(C.NUMDIRS):
+                side = rotate(d)
+                self.tunnel.append(nbr[4*i+side] < 0
+                                   and nbr[4*i+opposite(side)] < 0)
+
+    def compute_rooms(self):
+        """
+        Goal rooms, by entrance: rooms[(e, d)] is the room entered by
+        pushing a box from cell e in direction d. Only rooms without boxes
+        that can be filled in a fixed order are kept.
+        """
+        level = self.level
+        nbr = level.neighbours
+        fi = level.floor_index
+        targets = {fi[t] for t in level.targets}
+        boxes = {fi[b] for b in level.boxes}
+        player = fi[level.player_position]
+
+        self.rooms = {}
+        for e in range(len(level.floor)):
+            if e in targets:
+                continue
+            for d in range(C.NUMDIRS):
+                r0 = nbr[4*e+d]
+                # the player has to push the box from behind e
+                if r0 < 0 or nbr[4*e+opposite(d)] < 0:
+                    continue
+
+                # area behind the entrance
+                cells = [r0]
+                seen = {e, r0}
+                for c in cells:
+                    if len(cells) > C.ROOM_SIZE:
+                        break
+                    for dd in range(C.NUMDIRS):
+                        n = nbr[4*c+dd]
+                        if n >= 0 and n not in seen:
+                            seen.add(n)
+                            cells.append(n)
+                else:
+                    room = set(cells)
+                    if not room & targets or room & boxes or player in room:
+                        continue
+                    order = self.filling_order(e, r0, room, targets & room)
+                    if order is not None:
+                        self.rooms[(e, d)] = order
+
+    def filling_order(self, e, r0, room, targets):
+        """
+        Order in which boxes pushed from e to r0 can fill the targets of the
+        room, found by emptying the full room one target at a time.
+        Return the room cells and, in filling order, the targets with the
+        pushes leading to them, or None.
+        """
+        filled = set(targets)
+        order = []
+        while filled:
+            for t in sorted(filled):
+                macro = self.room_pushes(e, r0, room, filled - {t}, t)
+                if macro is not None:
+                    filled.remove(t)
+                    order.append((t,) + macro)
+                    break
+            else:
+                return None
+        order.reverse()
+        return {'cells': room, 'order': order}
+
+    def room_pushes(self, e, r0, room, boxes, target):
+        """
+        Breadth-first search of the pushes bringing the box from r0 to
+        'target', the player starting on e and the other boxes of the room
+        on 'boxes'.
+        Return the pushes, the final player cell and the number of moves,
+        or None.
+        """
+        nbr = self.level.neighbours
+        allowed = room | {e}
+        start = (r0, e)
+        prev = {start: None}
+        fifo = [start]
+        for state in fifo:
+            box, player = state
+            if box == target:
+                break
+            for d in range(C.NUMDIRS):
+                n = nbr[4*player+d]
+                if n not in allowed or n in boxes:
+                    continue
+                if n == box:
+                    n2 = nbr[4*n+d]
+                    if n2 not in allowed or n2 in boxes:
+                        continue
+                    # push, box on n pushed from side opposite(d)
+                    succ = (n2, n)
+                    move = (self.level.floor[n], opposite(d))
+                else:
+                    succ = (box, n)
+                    move = None
+                if succ not in prev:
+                    prev[succ] = (state, move)
+                    fifo.append(succ)
+        else:
+            return None
+
+        pushes = []
+        moves = 0
+        last = state
+        while prev[state] is not None:
+            state, move = prev[state]
+            moves += 1
+            if move is not None:
+                pushes.append(move)
+        pushes.reverse()
+        return tuple(pushes), last[1], moves
+
+
+def assignment_cost(cost):
+    """
+    Minimum total cost to assign each row of the 'cost' matrix to a
+    different column, with at least as many columns as rows.
+    Hungarian algorithm (shortest augmenting paths with potentials).
+    """
+    n = len(cost)
+    if n == 0:
+        return 0
+    m = len(cost[0])
+    u = [0] * (n+1)
+    v = [0] * (m+1)
+    match = [0] * (m+1)  # row matched to each column, 0 if none
+    way = [0] * (m+1)
+    for i in range(1, n+1):
+        match[0] = i
+        j0 = 0
+        minv = [INF * n] * (m+1)
+        used = [False] * (m+1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = cost[i0-1]
+            ui0 = u[i0]
+            delta = INF * n
+            j1 = 0
+            for j in range(1, m+1):
+                if not used[j]:
+                    cur = row[j-1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m+1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        # augment along the path
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    return -v[0]
+
+
+def resident_memory():
+    """
+    Memory of the process in megabytes: resident memory from /proc on
+    Linux, otherwise the peak resident memory from getrusage.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # in bytes on macOS, in kilobytes elsewhere
+        if sys.platform == 'darwin':
+            return peak / (1 << 20)
+        return peak / (1 << 10)
+
+
+# limits of a budget, as written in messages
+BUDGET_NAMES = {'time': 'temps', 'nodes': 'états', 'memory': 'mémoire'}
+
+
+class Budget:
+    """
+    Limits of a search: time in seconds, expanded states, and memory of the
+    process in megabytes, None for no limit. They are checked with the
+    progress of the search, every 31 expanded states.
+    """
+
+    def __init__(self, seconds=None, nodes=None, megabytes=None):
+        self.seconds = seconds
+        self.nodes = nodes
+        self.megabytes = megabytes
+
+    def exceeded(self, explored, elapsed, stats):
+        """
+        Return the limit exceeded ('time', 'nodes' or 'memory'), or None.
+        The memory measured is kept in 'stats'.
+        """
+        if self.seconds is not None and elapsed > self.seconds:
+            return 'time'
+        if self.nodes is not None and explored >= self.nodes:
+            return 'nodes'
+        if self.megabytes is not None:
+            memory = resident_memory()
+            stats.peak_memory = max(stats.peak_memory, round(memory, 1))
+            if memory > self.megabytes:
+                return 'memory'
+        return None
+
+
+class SearchStats:
+    """
+    Counters and timings of a search, to see where its time goes.
+    Times are in seconds.
+    """
+
+    # seconds between two samples of the speed
+    SAMPLE = 1
+
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        # states already expanded, popped again or generated again
+        self.duplicates = 0
+        # successors dropped as lost states
+        self.pruned = 0
+        self.peak_queue = 0
+        self.peak_states = 0
+        # in megabytes, only measured with a memory budget
+        self.peak_memory = 0
+        # limit of the budget exceeded, if any
+        self.exceeded = None
+        self.time_reach = 0
+        self.time_heuristic = 0
+        self.time_deadlock = 0
+        self.elapsed = 0
+        # (elapsed, expanded states, states/s since the previous sample)
+        self.speed = []
+
+    def sample(self, elapsed):
+        last, expanded = 0, 0
+        if self.speed:
+            last, expanded, _ = self.speed[-1]
+        if elapsed - last >= self.SAMPLE:
+            speed = (self.expanded - expanded) / (elapsed - last)
+            self.speed.append((round(elapsed, 3), self.expanded,
+                               round(speed, 1)))
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        for k in ('time_reach', 'time_heuristic', 'time_deadlock',
+                  'elapsed'):
+            stats[k] = round(stats[k], 3)
+        return stats
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+
+def pack_ints(values, width):
+    """
+    Non-negative integers as bytes, on 'width' bytes each.
+    """
+    return b''.join(v.to_bytes(width, 'little') for v in values)
+
+
+def unpack_ints(data, width):
+    return [int.from_bytes(data[i:i+width], 'little')
+            for i in range(0, len(data), width)]
+
+
+class NodeStore:
+    """
+    Nodes of a search, by integer id, in parallel arrays: parent node (-1
+    for a starting node), cell of the pushed box and side of the player,
+    cost, and the state itself, with the boxes as a bitboard and the cell
+    of the player.
+    A macro push leads to a node with several pushes, kept aside.
+    """
+
+    def __init__(self, static):
+        self.floor = static.floor
+        self.floor_index = static.floor_index
+        # bytes of a bitboard of boxes
+        self.width = (len(static.floor) + 7) // 8
+        self.parent = array('i')
+        self.cell = array('i')
+        self.side = array('b')
+        self.g = array('i')
+        self.player = array('i')
+        self.boxes = []
+        self.macros = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def add(self, state, parent, pushes, g):
+        """
+        Add the node of 'state', reached from node 'parent' with 'pushes'
+        (None for a starting node) and cost 'g'. Return its id.
+        """
+        node = len(self.boxes)
+        boxes, player = state
+        self.boxes.append(boxes)
+        self.player.append(player)
+        self.parent.append(parent)
+        self.g.append(g)
+        if pushes is None:
+            self.cell.append(-1)
+            self.side.append(-1)
+        else:
+            box, d = pushes[0]
+            self.cell.append(self.floor_index[box])
+            self.side.append(d)
+            if len(pushes) > 1:
+                self.macros[node] = pushes
+        return node
+
+    def state(self, node):
+        return (self.boxes[node], self.player[node])
+
+    def pushes(self, node):
+        macro = self.macros.get(node)
+        if macro is not None:
+            return macro
+        return ((self.floor[self.cell[node]], self.side[node]),)
+
+    def root(self, node):
+        while self.parent[node] >= 0:
+            node = self.parent[node]
+        return node
+
+    def path(self, node):
+        """
+        Pushes leading from the starting node to 'node'.
+        """
+        path = []
+        while self.parent[node] >= 0:
+            path.extend(reversed(self.pushes(node)))
+            node = self.parent[node]
+        path.reverse()
+        return path
+
+    def path_back(self, node):
+        """
+        Pushes leading from 'node' to its starting node, for the backward
+        search, where the pushes of a node lead to its parent.
+        """
+        path = []
+        while self.parent[node] >= 0:
+            path.extend(self.pushes(node))
+            node = self.parent[node]
+        return path
+
+    def dump(self):
+        """
+        All nodes, for a checkpoint, with the boxes packed as bytes.
+        """
+        return {
+            'parent': self.parent,
+            'cell': self.cell,
+            'side': self.side,
+            'g': self.g,
+            'player': self.player,
+            'boxes': pack_ints(self.boxes, self.width),
+            'macros': self.macros,
+        }
+
+    def restore(self, data):
+        for k in ('parent', 'cell', 'side', 'g', 'player', 'macros'):
+            setattr(self, k, data[k])
+        self.boxes = unpack_ints(data['boxes'], self.width)
+
+
 class BoxSolution:
-    def __init__(self, level, boxlist, dest=None):
+    def __init__(self, level, boxlist, dest=None, progress=None,
+                 bidirectional=False, mode='weighted', estimate='assignment',
+                 budget=None, checkpoint=None):
+        if mode not in MODES:
+            raise ValueError("Unknown search mode: " + mode)
+        if bidirectional and mode in OPTIMAL_MODES:
+            raise ValueError("No optimal bidirectional search")
         self.level = level
         self.boxlist = boxlist
         # these are the boxes we are allowed to move
         # others are considered walls
         self.dest = dest
+        # called as progress(explored, elapsed) during the search instead
+        # of updating the game, returns True to cancel the search
+        self.progress = progress
+        self.explored = 0
+        self.elapsed = 0
+        self.cancelled = False
+        self.stats = SearchStats()
+        # limits of the search, none by default
+        self.budget = budget or Budget()
+        # file where the search is saved from time to time, and resumed
+        # from if it exists
+        self.checkpoint = checkpoint
+        # the search only works on the static structure of the level, and
+        # never changes the level itself
+        self.static = static = level.static
+        self.game = level.game
+        fi = static.floor_index
+        self.targetbits = static.targetbits
+        self.destbits = 1 << fi[dest] if dest in fi else 0
+        self.dest_free = dest is None or level.is_empty(dest)
+        # initial state, and the other boxes, that stay where they are
+        self.init_state = self.make_state()
+        self.fixed = bitboard(fi[b] for b in level.boxes) \
+            & ~self.init_state[0]
+        # attainable tiles, on a reachability engine of its own
+        self.reach = Reach(static)
+        # bits of the player cell in a state hash
+        self.shift = len(static.floor).bit_length()
         if dest:
-            self.target = dest  # for manhattan heuristic
             assert (len(boxlist) == 1)
+        # push distances to each target (or to dest), for the heuristic
+        if dest in fi:
+            todest = PushDistances(static).from_target(fi[dest])
+            self.dist = [[d] for d in todest]
         else:
-            # target on most on lower right corner
-            for y in reversed(range(self.level.height)):
-                for x in reversed(range(self.level.width)):
-                    if self.level.is_target((x, y)):
-                        self.target = (x, y)
-                        return
-
-    def save_level_state(self, boxes):
-        self.saveplayer = self.level.position_player
-        self.saveboxes = []
-
-    def restore_level_state(self):
-        self.level.position_player = self.saveplayer
-
-        for (x, y), old in self.saveboxes:
-            self.level.structure[y][x] = old
+            self.dist = static.push_dist
+        # the cost of a state is the number of pushes in 'pushes' mode,
+        # of moves otherwise; optimal modes need an admissible heuristic,
+        # which the push lower bound is for both
+        self.mode = mode
+        self.optimal = mode in OPTIMAL_MODES
+        self.weight = 1 if self.optimal else WEIGHT
+        # number of pushes and moves of the solution found
+        self.pushes = None
+        self.moves = None
+        # heuristic: 'assignment' of boxes to different targets, or sum of
+        # distances to the 'closest' target, quicker but less informed
+        self.estimate = estimate
+        # also search backward from the goals, pulling boxes, until both
+        # searches meet
+        self.bidirectional = bidirectional
 
     def make_state(self):
-        tboxes = tupleit(self.level.mboxes)
-        tblist = tupleit(self.boxlist)
+        """
+        Compact state of the level as it is: (boxes, player), with the boxes
+        to move as a bitboard over the interior floor cells and the player
+        as the index of its floor cell.
+        """
+        fi = self.level.floor_index
+        boxes = bitboard(fi[b] for b in self.boxlist)
+        return (boxes, fi[self.level.player_position])
 
-        # do not invalidate, but make 'virtual' dijkstra
-        allsides = self.level.box_attainable_sides(self.boxlist, virtual=True)
+    def state_hash(self, state):
+        """
+        Hash of the state currently set in the reachability engine.
+        The player is replaced by the top-left cell it can reach, so all
+        states whose player is in the same area share the same hash.
+        Floor cells are numbered row by row, this is the smallest index.
+        Both are packed in a single integer, smaller than a tuple.
+        In 'moves' mode, the remaining moves depend on where the player is
+        exactly, its own cell is used instead.
+        """
+        boxes, player = state
+        if self.mode == 'moves':
+            return boxes << self.shift | player
+        return boxes << self.shift | self.reach.top
 
-        return ((tboxes, allsides), tblist, self.level.player_position)
+    def box_positions(self, boxes):
+        floor = self.static.floor
+        return [floor[i] for i in bit_indices(boxes)]
 
-    def reset_level_state(self, state):
+    def reset_state(self, state):
         """
-        remove boxes based on list
+        Remove the boxes of 'state' from the reachability engine.
         """
-        _, boxes, _ = state
-        for x, y in boxes:
-            self.level.mboxes[y][x] = False
+        boxes, _ = state
+        occ = self.reach.occupied
+        for i in bit_indices(boxes):
+            occ[i] = 0
 
-    def set_level_state(self, state):
-        _, boxes, player = state
-        for x, y in boxes:
-            self.level.mboxes[y][x] = True
+    def set_state(self, state):
+        """
+        Place the boxes of 'state' in the reachability engine, and compute
+        the cells attainable by the player.
+        """
+        boxes, player = state
+        occ = self.reach.occupied
+        for i in bit_indices(boxes):
+            occ[i] = 1
+        self.reach.flood(player)
 
-        self.level.boxes = list(boxes)
-        self.boxlist = self.level.boxes
-        self.level.set_player(player)
-        self.level.invalidate()
-        self.level.box_attainable_sides(self.boxlist)
+    def set_fixed_boxes(self):
+        occ = self.reach.occupied
+        for i in bit_indices(self.fixed):
+            occ[i] = 1
 
     def acceptable_state(self, state):
-        _, boxes, player = state
+        boxes, player = state
 
         if not self.dest is None:
-            box = boxes[0]
-            return box == self.dest
+            return boxes == self.destbits
 
         # otherwise, check all boxes are on targets
-        for box in boxes:
-            if not self.level.is_target(box):
-                return False
-        return True
-
-    def lost_state(self, state):
-        (mapboxes, _), boxes, _ = state
-        return self.level.lost_state(mapboxes, boxes)
+        return boxes & ~self.targetbits == 0
 
     def solve(self):
         """
@@ -264,128 +903,354 @@ class BoxSolution:
         moving other boxes
         """
 
-        if self.dest != None and not self.level.is_empty(self.dest):
+        if not self.dest_free:
             return (False, "Destination impossible", None)
 
-        # save current state of level w.r.t box & player
-        self.save_state = self.level.get_current_state()
+        # initial state: boxes + player position
+        init_state = self.init_state
 
-        # initial state: boxes + their attainable sides
-        init_state = self.make_state()
-        init_hash, init_boxes, init_player = init_state
+        # all states queued, with the push leading to each of them
+        nodes = NodeStore(self.static)
 
+        # expanded states: node of each state hash
         states = {}
-        states[init_hash] = {
-            'boxes': init_boxes,
-            'prev': None,
-            # box 'pushed' represents player
-            'push': (self.level.player_position, None)
-        }
 
-        # clear existing boxes
-        for x, y in self.boxlist:
-            assert (self.level.mboxes[y][x])
-            self.level.mboxes[y][x] = False
+        # other boxes are fixed, the engine only has to know about them once
+        self.set_fixed_boxes()
 
         # explore neighbouring states
-        # for now, no weight
-
-        prioqueue = [(0, 0, init_state)]
-        heapq.heapify(prioqueue)
+        # the hash of a state is only known once it is expanded, queued
+        # states are nodes, with the node they come from
+        # entries are (f, -g, node): among states of the same priority, the
+        # deepest one comes first, instead of all states of this priority
+        # being expanded before going deeper
+        prioqueue = [(0, 0, nodes.add(init_state, -1, None, 0))]
+
+        # backward search, with its own nodes and expanded states: the push
+        # of a node leads to its parent, closer to a goal
+        backqueue = []
+        backnodes = NodeStore(self.static)
+        backstates = {}
+        if self.bidirectional:
+            backqueue = self.goal_states(backnodes)
+            # push distances from the initial boxes, for its heuristic
+            pd = PushDistances(self.static)
+            per_box = [pd.from_box(i) for i in bit_indices(init_state[0])]
+            self.start_dist = [list(row) for row in zip(*per_box)]
+        searching_back = backqueue != []
 
         found = None
+        meet = None
         cancelled = False
 
         states_explored = 0
+        stats = self.stats = SearchStats()
+
+        searches = [(prioqueue, nodes, states),
+                    (backqueue, backnodes, backstates)]
+        saved = self.load_checkpoint(searches)
+        elapsed = 0
+        if saved is not None:
+            states_explored, elapsed, searching_back = saved
+            stats = self.stats
+        next_save = elapsed + C.CHECKPOINT_INTERVAL
+        check_due = False
+
+        start_time = time() - elapsed
+
+        try:
+            while not found and prioqueue != []:
+                if check_due:
+                    # update text and check cancel, between two states so
+                    # that the search can be saved as it is
+                    check_due = False
+                    elapsed = time() - start_time
+                    stats.peak_states = max(stats.peak_states,
+                                            len(nodes) + len(backnodes))
+                    stats.sample(elapsed)
+                    stats.exceeded = self.budget.exceeded(states_explored,
+                                                          elapsed, stats)
+                    if stats.exceeded:
+                        break
+                    cancelled = self.check_cancel(states_explored, elapsed)
+                    if cancelled:
+                        break
+                    if self.checkpoint is not None and elapsed >= next_save:
+                        self.save_checkpoint(searches, searching_back,
+                                             states_explored, elapsed)
+                        next_save = elapsed + C.CHECKPOINT_INTERVAL
+
+                # expand the search with the smallest frontier
+                backward = searching_back and len(backqueue) < len(prioqueue)
+                if backward and backqueue == []:
+                    # no more states leading to a goal
+                    break
+                if backward:
+                    heap, expanded, other = backqueue, backstates, states
+                    store = backnodes
+                else:
+                    heap, expanded, other = prioqueue, states, backstates
+                    store = nodes
+
+                stats.peak_queue = max(stats.peak_queue,
+                                       len(prioqueue) + len(backqueue))
+                _, dist, node = heapq.heappop(heap)
+                dist = -dist
+                state = store.state(node)
+                s_boxes, s_player = state
+                verbose("Looking for successors of boxes:", s_boxes,
+                        "player:", s_player, "distance:", dist)
+
+                if self.optimal and node and self.acceptable_state(state):
+                    # goals are queued as any state, the first one out of the
+                    # queue has the lowest cost
+                    found = state
+                    found_push = (node, ())
+                    break
 
-        start_time = time()
-
-        while not found and prioqueue != []:
-            _, dist, state = heapq.heappop(prioqueue)
-            s_hash, s_boxes, s_player = state
-            verbose("Looking for successors of boxes:", s_boxes,
-                    "player:", s_player, "distance:", dist)
-
-            data = states[s_hash]
-            self.set_level_state(state)
-
-            states_explored += 1
-
-            if states_explored % 31 == 0:
-                if states_explored % 155 == 0:
-                    self.level.game.update_screen()
+                t = time()
+                self.set_state(state)
+
+                # attainable area is computed once here and shared by all
+                # successors, which only need the hash of this state
+                s_hash = self.state_hash(state)
+                stats.time_reach += time() - t
+                if s_hash in expanded:
+                    # already expanded, with player in the same area
+                    stats.duplicates += 1
+                    self.reset_state(state)
+                    continue
+                expanded[s_hash] = node
+
+                states_explored += 1
+                stats.expanded = states_explored
+                check_due = states_explored % 31 == 0
+
+                if s_hash in other:
+                    # both searches meet: the goal the backward search started
+                    # from is reached
+                    meet = s_hash
+                    found = backnodes.state(backnodes.root(backstates[meet]))
+                    self.reset_state(state)
+                    break
 
-                # update text and check cancel
-                elapsed = time() - start_time
-                speed = states_explored/elapsed
+                if backward:
+                    for st, pushes, moves in self.predecessor_states(state):
+                        stats.generated += 1
+                        t = time()
+                        h = self.heuristic(st, self.start_dist)
+                        stats.time_heuristic += time() - t
+                        if h >= INF:
+                            # some boxes cannot come from an initial box
+                            continue
+                        f = self.priority(dist + moves, h)
+                        pred = backnodes.add(st, node, pushes, dist+moves)
+                        heapq.heappush(backqueue, (f, -(dist+moves), pred))
+                    self.reset_state(state)
+                    continue
 
-                message = MSG_SOLVE.format(
-                    exp=states_explored, el=elapsed, sp=speed)
-                cancelled = self.level.game.check_cancel(message)
-                if cancelled:
-                    break
+                # self.level.game.debug()
+                # Search for all successor states of current state
+                succs = self.successor_states(state)
 
-            # self.level.game.debug()
-            # Search for all successor states of current state
-            succs = self.successor_states(state)
-
-            for st, (box, direct), moves in succs:
-                sthash, stboxes, player = st
-                # print ("retrieved succ:", st)
-                verbose("\tsuc: b:", box, "d:", C.DNAMES[direct], "m:", moves)
-
-                if sthash not in states:
-                    states[sthash] = {
-                        'boxes': stboxes,
-                        'prev': s_hash,
-                        'push': (box, direct),  # so player is at box
-                    }
-                    # stores current box list +
-                    # previous state + box player has to push & in which
-                    # direction box
+                stats.generated += len(succs)
+                for st, pushes, moves, lost, sthash in succs:
+                    # print ("retrieved succ:", st)
+                    box, direct = pushes[0]
+                    verbose("\tsuc: b:", box, "d:", C.DNAMES[direct],
+                            "m:", moves)
 
-                    if self.acceptable_state(st):
+                    cost = self.step_cost(pushes, moves)
+                    if self.acceptable_state(st) and not self.optimal:
                         # found destination !
                         found = st
+                        found_push = (node, pushes)
                         break
-                    if self.lost_state(st):
-                        # self.set_level_state(st)
+                    if lost:
+                        # self.set_state(st)
                         # self.level.game.update_screen()
                         # self.level.game.wait_key()
+                        stats.pruned += 1
+                        continue
+                    if sthash in states:
+                        # already expanded
+                        stats.duplicates += 1
                         continue
 
+                    t = time()
                     h = self.heuristic(st)
+                    stats.time_heuristic += time() - t
+                    if h >= INF:
+                        # some boxes can no longer reach a target
+                        continue
 
-                    heapq.heappush(prioqueue, (dist+moves+h, dist+moves, st))
-            self.reset_level_state(state)
+                    f = self.priority(dist + cost, h)
+                    succ = nodes.add(st, node, pushes, dist+cost)
+                    heapq.heappush(prioqueue, (f, -(dist+cost), succ))
+                self.reset_state(state)
+        except MemoryError:
+            # whatever the budget, give up with the statistics so far
+            prioqueue = backqueue = None
+            states.clear()
+            backstates.clear()
+            stats.exceeded = 'memory'
+            found = None
 
         if not found:
             path = None
-            if cancelled:
-                message = "Annulée après exploration de "+str(states_explored) +\
-                    " états"
-            else:
-                message = "Échouée après exploration de "+str(states_explored) +\
-                    " états (aucune solution possible)"
+            message = self.failure_message(states_explored, cancelled)
         else:
             # create path
-            path = self.path_from(init_state, found, states)
+            if meet is not None:
+                path = nodes.path(states[meet]) \
+                    + backnodes.path_back(backstates[meet])
+            else:
+                last, last_pushes = found_push
+                path = nodes.path(last) + list(last_pushes)
             elapsed = time() - start_time
             message = "Solution trouvée après exploration de "+str(states_explored) + " états en " \
-                + str(round(elapsed, 1)) + " secondes"
-
-        # restore level
-        self.level.restore_state(self.save_state)
+                + str(round(elapsed, 1)) + " secondes" + self.count_path(path)
+
+        if self.checkpoint is not None:
+            if found or not (cancelled or stats.exceeded):
+                # nothing left to resume
+                self.remove_checkpoint()
+            elif prioqueue is not None:
+                # stopped between two states, to go on later
+                self.save_checkpoint(searches, searching_back,
+                                     states_explored, time() - start_time)
+
+        self.explored = states_explored
+        self.elapsed = time() - start_time
+        self.cancelled = cancelled
+        stats.peak_states = max(stats.peak_states,
+                                len(nodes) + len(backnodes))
+        stats.elapsed = self.elapsed
 
         self.final_state = found
         self.path = path
 
         return (found, message, path)
 
+    def checkpoint_key(self):
+        """
+        What a checkpoint has to match to be resumed by this search.
+        """
+        return (CHECKPOINT_VERSION, self.level.layout, self.init_state,
+                self.fixed, self.dest, self.mode, self.estimate,
+                self.bidirectional)
+
+    def save_checkpoint(self, searches, searching_back, explored, elapsed):
+        """
+        Save the forward and backward searches, as (queue, nodes, expanded
+        states), to the checkpoint file, with what is needed to resume
+        them exactly where they are.
+        State hashes are packed as bytes, queue entries in an array.
+        """
+        width = (len(self.static.floor) + self.shift + 7) // 8
+        saved = []
+        for heap, nodes, states in searches:
+            saved.append({
+                'queue': array('i', [x for entry in heap for x in entry]),
+                'nodes': nodes.dump(),
+                'hashes': pack_ints(states.keys(), width),
+                'states': array('i', states.values()),
+            })
+        data = {
+            'key': self.checkpoint_key(),
+            'explored': explored,
+            'elapsed': elapsed,
+            'searching_back': searching_back,
+            'stats': vars(self.stats),
+            'searches': saved,
+        }
+        verbose("Saving checkpoint after", explored, "states")
+        # written aside then renamed, not to leave a truncated file
+        tmp = self.checkpoint + '.' + str(os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(data, 4), 1))
+            os.replace(tmp, self.checkpoint)
+        except OSError as e:
+            print("Cannot save checkpoint:", e)
+
+    def load_checkpoint(self, searches):
+        """
+        Restore the searches from the checkpoint file if there is one for
+        this search, in place. Return the number of explored states, the
+        elapsed time and whether the backward search goes on, or None.
+        """
+        if self.checkpoint is None:
+            return None
+        try:
+            with open(self.checkpoint, 'rb') as f:
+                data = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+            print("Cannot read checkpoint:", e)
+            return None
+        if data['key'] != self.checkpoint_key():
+            print("Checkpoint", self.checkpoint, "is for another search")
+            return None
+
+        width = (len(self.static.floor) + self.shift + 7) // 8
+        for (heap, nodes, states), saved in zip(searches, data['searches']):
+            q = saved['queue']
+            heap[:] = zip(q[0::3], q[1::3], q[2::3])
+            nodes.restore(saved['nodes'])
+            states.clear()
+            states.update(zip(unpack_ints(saved['hashes'], width),
+                              saved['states']))
+        vars(self.stats).update(data['stats'])
+        self.stats.exceeded = None
+        verbose("Resuming from checkpoint after", data['explored'], "states")
+        return data['explored'], data['elapsed'], data['searching_back']
+
+    def remove_checkpoint(self):
+        try:
+            os.remove(self.checkpoint)
+        except FileNotFoundError:
+            pass
+
+    def failure_message(self, explored, cancelled):
+        """
+        Message of a search without solution, after 'explored' states.
+        """
+        if self.stats.exceeded is not None:
+            return "Budget dépassé (" + BUDGET_NAMES[self.stats.exceeded] \
+                + ") après exploration de " + str(explored) + " états"
+        if cancelled:
+            return "Annulée après exploration de " + str(explored) + \
+                " états"
+        return "Échouée après exploration de " + str(explored) + \
+            " états (aucune solution possible)"
+
+    def check_cancel(self, explored, elapsed):
+        """
+        Report the progress of the search, to the progress callback if any,
+        otherwise to the game if there is one.
+        Return True if the search has to be cancelled.
+        """
+        if self.progress is not None:
+            return self.progress(explored, elapsed)
+
+        game = self.game
+        if game is None:
+            return False
+
+        if explored % 155 == 0:
+            game.update_screen()
+
+        speed = explored/elapsed
+        message = MSG_SOLVE.format(exp=explored, el=elapsed, sp=speed)
+        return game.check_cancel(message)
+
     def improve(self):
         # trying to improve final state if only one box by pushing it as much
         # as we can
-        sthash, stboxes, player = self.final_state
+        stboxes, player = self.final_state
+        stboxes = self.box_positions(stboxes)
         assert (len(stboxes) == 1)
         assert (self.path is not None)
 
@@ -402,17 +1267,24 @@ class BoxSolution:
             box = sucbox
             sucbox = in_dir(box, d)
 
-        # now see if it can be pushed on one side
+        # now see if it can be pushed on one side, from a side the player
+        # can reach, standing behind the box after its last push
         side = rotate(d)
         sideo = opposite(side)
+        fi = self.static.floor_index
+        self.reach.load_boxes(list(bit_indices(self.fixed)) + [fi[box]])
+        self.reach.flood(fi[in_dir(box, opposite(d))])
 
         go = None
         if self.level.is_empty(in_dir(box, side)) \
                 and self.level.is_empty(in_dir(box, sideo)):
-            if self.level.is_target(in_dir(box, side)):
-                go = side
-            elif self.level.is_target(in_dir(box, sideo)):
-                go = sideo
+            for s in (side, sideo):
+                if self.level.is_target(in_dir(box, s)) \
+                        and self.reach.is_marked(fi[in_dir(box, opposite(s))]):
+                    go = s
+                    break
+        # back to the fixed boxes only, as after the search
+        self.reach.load_boxes(bit_indices(self.fixed))
 
         if go is not None:
             d = go
@@ -423,110 +1295,412 @@ class BoxSolution:
                 box = sucbox
                 sucbox = in_dir(box, d)
 
-    def manhattan(self, source, dest):
-        sx, sy = source
-        dx, dy = dest
-        return abs(dx-sx) + abs(dy-sy)
-
-    def heuristic(self, state):
+    def heuristic(self, state, dist=None):
         """
-        Lower bound for approximated number of box movements for 
-        A*: sum of all manhattan distances to random target
+        Lower bound of the number of pushes still needed for A*: boxes are
+        assigned to different targets with a minimal sum of push distances.
+        It is INF or more if the boxes cannot all reach a target.
+        With the 'closest' estimate, each box goes to its closest target.
+        The backward search gives the distances from the initial boxes
+        instead, as 'dist'.
         """
         # just change to 0 to get Dijkstra
         # return 0
-        _, sblist, _ = state
-
-        hdist = 0
-        surf = self.level.width * self.level.height
-        for box in sblist:
-            m = self.manhattan(box, self.target)
-
-            # hdist += m*m  ## good for open levels
-            # hdist += m
-            # hdist += int(sqrt(m))
+        if dist is None:
+            dist = self.dist
+        sboxes, _ = state
+        rows = [dist[i] for i in bit_indices(sboxes)]
+
+        if len(rows) == 1:
+            return min(rows[0])
+        if self.estimate == 'closest' or len(rows) > len(rows[0]):
+            # more boxes than targets, no assignment possible
+            return sum(min(r) for r in rows)
+        return assignment_cost(rows)
+
+    def priority(self, g, h):
+        """
+        Order of a state in the queue, from its cost 'g' and heuristic 'h'.
+        """
+        if self.mode == 'greedy':
+            return h
+        return g + self.weight*h
 
-            # Trying special for labyrinth-like levels
-            #
-            heur = surf * m
-            heur -= m*(m+1)//2
-            hdist += heur
+    def step_cost(self, pushes, moves):
+        """
+        Cost of going to a successor with 'pushes' after 'moves' in all.
+        """
+        if self.mode == 'pushes':
+            return len(pushes)
+        return moves
 
-        return hdist
+    def count_path(self, path):
+        """
+        Count the pushes of 'path' and the moves of the player along it,
+        walking the shortest way between pushes, from the initial state with
+        the fixed boxes set. Return them as the end of a message.
+        """
+        reach = self.reach
+        nbr = reach.nbr
+        occ = reach.occupied
+        fi = self.static.floor_index
+        boxes, player = self.init_state
+        self.set_state(self.init_state)
+        moves = 0
+        for box, d in path:
+            b = fi[box]
+            dest = nbr[4*b+opposite(d)]
+            moves += reach.dist[nbr[4*b+d]] + 1
+            occ[b] = 0
+            occ[dest] = 1
+            boxes = boxes & ~(1 << b) | 1 << dest
+            reach.flood(b)
+        self.reset_state((boxes, player))
+
+        self.pushes = len(path)
+        self.moves = moves
+        return " ({} poussées, {} déplacements)".format(self.pushes,
+                                                        self.moves)
 
     def successor_states(self, state):
-
-        (sboxes, allsides), sblist, splayer = state
+        """
+        Successors of the state currently set in the level, the player
+        attainable area has already been computed by set_state.
+        """
         alls = []
-        for i, b in enumerate(sblist):
-            succs = self.successor_states_one_box(b, allsides[i], splayer)
+        for b in bit_indices(state[0]):
+            succs = self.successor_states_one_box(state, b)
             alls += succs
         return alls
 
-    def successor_states_one_box(self, box, sides, player):
-        box, sides
-        bx, by = box
+    def successor_states_one_box(self, state, b):
+        boxes, _ = state
+        reach = self.reach
+        nbr = reach.nbr
+        box = self.static.floor[b]
         succs = []
 
-        for d, flag in enumerate(sides):
-            if flag:  # this side is reachable by player
-                opp = in_opp_dir(box, d)
-                if self.level.is_empty(opp):
-                    # self.level.dij.show_distances()
-                    # print ('distance from', player, 'to', in_dir(box,d), C.DNAMES[d])
-                    dist = self.level.dij.distance(in_dir(box, d))
+        for d in range(C.NUMDIRS):
+            side = nbr[4*b+d]
+            if side >= 0 and reach.is_marked(side):
+                # this side is reachable by player
+                dest = nbr[4*b+opposite(d)]
+                if dest >= 0 and not reach.occupied[dest]:
+                    dist = reach.dist[side]
+
+                    macro = self.macro_pushes(b, dest, opposite(d))
+                    if macro is not None:
+                        # box pushed further on
+                        pushes, last, player, moves = macro
+                        stsuc, lost = self.create_successor(
+                            boxes, b, last, player)
+                        succs.append((stsuc, ((box, d),) + pushes,
+                                      dist+1+moves, lost, None))
+                        continue
 
                     # player position will be at box current one
-                    stsuc = self.create_successor(box=opp, player=box)
-                    # print ('distance here:', dist)
+                    stsuc, lost = self.create_successor(boxes, b, dest, b)
+
+                    # when the box goes out of the attainable area, the
+                    # attainable area of the successor is an extension of
+                    # the current one: its hash is cheap to get
+                    sthash = None
+                    if self.mode == 'moves':
+                        sthash = stsuc[0] << self.shift | b
+                    elif not reach.is_marked(dest):
+                        t = time()
+                        undo = reach.push(b, dest)
+                        sthash = stsuc[0] << self.shift | reach.top
+                        reach.undo_push(undo)
+                        self.stats.time_reach += time() - t
+
                     # also store the box & direction pushed from
-                    succs.append((stsuc, (box, d), dist+1))
+                    succs.append((stsuc, ((box, d),), dist+1, lost, sthash))
         return succs
 
-    def create_successor(self, box, player):
+    def macro_pushes(self, src, dest, d):
         """
-        Create successor state, as if player has just pushed a box.
-        Hence box is the new position, and player is where the box
-        was before it was pushed.
+        Pushes that follow the push of a box from cell 'src' to 'dest' in
+        direction d, if it enters a tunnel or a goal room.
+        Return the pushes, the final cells of the box and the player and the
+        number of moves, or None.
         """
+        static = self.static
+        occ = self.reach.occupied
+        floor = static.floor
+
+        room = None
+        if self.dest is None and not self.optimal:
+            # rooms are filled in a fixed order, not the shortest one
+            room = static.rooms.get((src, d))
+        if room is not None:
+            # the room has to be filled in order, with no other box inside
+            order = room['order']
+            filled = 0
+            while filled < len(order) and occ[order[filled][0]]:
+                filled += 1
+            if filled == len(order) \
+                    or sum(occ[c] for c in room['cells']) != filled:
+                return None
+            target, pushes, player, moves = order[filled]
+            if not pushes:
+                return None
+            return pushes, target, player, moves
+
+        # keep on pushing along a tunnel, up to a target
+        nbr = self.reach.nbr
+        tunnel = static.tunnel
+        stop = self.targetbits | self.destbits
+        pushes = []
+        player, box = src, dest
+        while tunnel[4*box+d] and tunnel[4*player+d] \
+                and not stop >> box & 1:
+            n = nbr[4*box+d]
+            if n < 0 or occ[n]:
+                break
+            pushes.append((floor[box], opposite(d)))
+            player, box = box, n
+        if not pushes:
+            return None
+        return tuple(pushes), box, player, len(pushes)
+
+    def goal_states(self, nodes):
+        """
+        Queue entries to start the backward search: boxes on the goal cells,
+        with the player in each area next to a box, added to 'nodes'.
+        Empty if there are too many possible goals.
+        """
+        fi = self.static.floor_index
+        reach = self.reach
+        if self.dest is not None:
+            goals = [self.destbits]
+        else:
+            free = [fi[t] for t in self.static.targets
+                    if not reach.occupied[fi[t]]]
+            if len(free) == len(self.boxlist):
+                goals = [bitboard(free)]
+            elif len(self.boxlist) == 1:
+                goals = [1 << t for t in free]
+            else:
+                return []
+
+        entries = []
+        for boxes in goals:
+            for i in bit_indices(boxes):
+                reach.occupied[i] = 1
+            seen = set()
+            for i in bit_indices(boxes):
+                for d in range(C.NUMDIRS):
+                    n = reach.nbr[4*i+d]
+                    if n < 0 or reach.occupied[n] or n in seen:
+                        continue
+                    seen.update(reach.flood(n))
+                    entries.append((0, 0, nodes.add((boxes, n), -1, None, 0)))
+            for i in bit_indices(boxes):
+                reach.occupied[i] = 0
+        return entries
 
-        # save current state
-        saveplayer = self.level.player_position
+    def predecessor_states(self, state):
+        """
+        States from which one push leads to the state currently set in the
+        reachability engine, for the backward search: the player pulls a box
+        while going away from it. Given with the push as in the forward
+        search, and the moves made.
+        """
+        boxes, _ = state
+        reach = self.reach
+        nbr = reach.nbr
+        floor = self.static.floor
+        preds = []
+        for b in bit_indices(boxes):
+            for d in range(C.NUMDIRS):
+                side = nbr[4*b+d]
+                if side < 0 or not reach.is_marked(side):
+                    continue
+                back = nbr[4*side+d]
+                if back < 0 or reach.occupied[back]:
+                    continue
+                # box pulled to side, player going back: from there, the box
+                # is pushed to b
+                st = (boxes ^ (1 << b) | (1 << side), back)
+                preds.append((st, ((floor[side], d),), reach.dist[side] + 1))
+        return preds
 
-        # prepare successor state
-        self.level.place_box(box)
-        self.level.clear_box(player)
-        self.level.player_position = player
+    def create_successor(self, boxes, source, box, player):
+        """
+        Create successor state, as if player has just pushed a box from
+        cell 'source' to cell 'box', ending on cell 'player' (where the box
+        was before the last push), the boxes being on 'boxes' before.
+        Also tells whether the successor is a lost state.
+        """
+        succ = boxes & ~(1 << source) | 1 << box
+        t = time()
+        lost = self.static.lost(succ | self.fixed, player, pushed=box)
+        self.stats.time_deadlock += time() - t
+        return (succ, player), lost
 
-        boxi = self.boxlist.index(player)
-        self.boxlist[boxi] = box
 
-        st = self.make_state()
+class IDASolution(BoxSolution):
+    """
+    Iterative-deepening A*: depth-first searches with an increasing bound
+    on the cost, so that only the current path is kept in memory.
+    A transposition table of bounded size, emptied of the least recently
+    used states, avoids most of the searches from an already seen state.
+    Same use as BoxSolution, without the bidirectional and greedy modes.
+    """
 
-        # restore state
-        self.level.player_position = saveplayer
-        self.level.place_box(player)
-        self.level.clear_box(box)
-        self.boxlist[boxi] = player
+    def __init__(self, level, boxlist, dest=None, progress=None,
+                 bidirectional=False, mode='weighted',
+                 table_size=C.TABLE_SIZE, estimate='assignment', budget=None,
+                 checkpoint=None):
+        if mode == 'greedy':
+            raise ValueError("No greedy iterative deepening")
+        if bidirectional:
+            raise ValueError("No bidirectional iterative deepening")
+        if checkpoint is not None:
+            raise ValueError("No checkpoint of iterative deepening")
+        super().__init__(level, boxlist, dest=dest, progress=progress,
+                         mode=mode, estimate=estimate, budget=budget)
+        self.table_size = table_size
+
+    def seen(self, table, sthash, g, iteration):
+        """
+        Check if the state with hash 'sthash' has already been reached with
+        a cost at most 'g' during this iteration, otherwise record it.
+        """
+        entry = table.get(sthash)
+        if entry is not None:
+            table.move_to_end(sthash)
+            if entry[1] == iteration and entry[0] <= g:
+                return True
+        table[sthash] = (g, iteration)
+        if len(table) > self.table_size:
+            table.popitem(last=False)
+        return False
 
-        return st
+    def solve(self):
+        if not self.dest_free:
+            return (False, "Destination impossible", None)
 
-    def path_from(self, source_state, found_state, states):
+        init_state = self.init_state
+        self.set_fixed_boxes()
 
-        source_hash, _, _ = source_state
-        found_hash, _, _ = found_state
+        # hash -> (lowest cost, iteration), least recently used first
+        table = OrderedDict()
 
-        current = found_hash
+        found = None
+        cancelled = False
+        states_explored = 0
+        stats = self.stats = SearchStats()
+        start_time = time()
 
-        path = []
+        bound = self.weight * self.heuristic(init_state)
+        iteration = 0
+        while not found and not cancelled and bound < INF:
+            iteration += 1
+            next_bound = INF
+
+            # depth-first search with an explicit stack, pushes of the
+            # current path are in 'path' (several for a macro push)
+            stack = [(bound, 0, init_state, 0, None)]
+            path = []
+            while stack:
+                stats.peak_queue = max(stats.peak_queue, len(stack))
+                f, dist, state, depth, pushes = stack.pop()
+                del path[max(depth-1, 0):]
+                if pushes is not None:
+                    path.append(pushes)
+                if f > bound:
+                    next_bound = min(next_bound, f)
+                    continue
 
-        while current != source_hash:
+                t = time()
+                self.set_state(state)
+                s_hash = self.state_hash(state)
+                stats.time_reach += time() - t
+                if self.seen(table, s_hash, dist, iteration):
+                    stats.duplicates += 1
+                    self.reset_state(state)
+                    continue
 
-            node = states[current]
+                states_explored += 1
+                stats.expanded = states_explored
+                if states_explored % 31 == 0:
+                    elapsed = time() - start_time
+                    stats.peak_states = max(stats.peak_states, len(table))
+                    stats.sample(elapsed)
+                    stats.exceeded = self.budget.exceeded(states_explored,
+                                                          elapsed, stats)
+                    cancelled = stats.exceeded is not None \
+                        or self.check_cancel(states_explored, elapsed)
+                    if cancelled:
+                        self.reset_state(state)
+                        break
 
-            path.append(node['push'])
-            current = node['prev']
+                children = []
+                succs = self.successor_states(state)
+                stats.generated += len(succs)
+                for st, pushes, moves, lost, sthash in succs:
+                    g = dist + self.step_cost(pushes, moves)
+                    if self.acceptable_state(st):
+                        if self.optimal and g > bound:
+                            # a shorter solution may still be found
+                            next_bound = min(next_bound, g)
+                            continue
+                        found = st
+                        path.append(pushes)
+                        break
+                    if lost:
+                        stats.pruned += 1
+                        continue
+                    if sthash is not None and sthash in table:
+                        entry = table[sthash]
+                        if entry[1] == iteration and entry[0] <= g:
+                            stats.duplicates += 1
+                            continue
+                    t = time()
+                    h = self.heuristic(st)
+                    stats.time_heuristic += time() - t
+                    if h >= INF:
+                        continue
+                    children.append((self.priority(g, h), g, st, depth+1,
+                                     pushes))
+                self.reset_state(state)
+                if found:
+                    break
 
-        return list(reversed(path))
+                # best successors are searched first
+                children.sort(key=lambda c: c[0], reverse=True)
+                stack += children
+
+            bound = max(next_bound, bound + self.weight)
+
+        elapsed = time() - start_time
+        if not found:
+            path = None
+            message = self.failure_message(states_explored, cancelled)
+        else:
+            path = [push for pushes in path for push in pushes]
+            message = "Solution trouvée après exploration de " + \
+                str(states_explored) + " états en " + \
+                str(round(elapsed, 1)) + " secondes" + self.count_path(path)
+
+        self.explored = states_explored
+        self.elapsed = elapsed
+        self.cancelled = cancelled
+        stats.peak_states = max(stats.peak_states, len(table))
+        stats.elapsed = elapsed
+
+        self.final_state = found
+        self.path = path
+
+        return (found, message, path)
+
+
+# search engines, by name
+ENGINES = {
+    'astar': BoxSolution,
+    'ida': IDASolution,
+}
 
 # END_CUT
@@ -15,6 +15,10 @@ from level import *
 from explore import *
 import scores as S
 from queue import Queue
+# START_CUT
+from background import BackgroundSolver
+from portfolio import PortfolioSolver, mode_configs
+# END_CUT
 
 # correspondance between keys on keyboard and direction in Sokoban
 KEYDIR = {
@@ -70,6 +74,7 @@ class GameInterface:
 
     def reset(self):
         self.deactivate_cancel()
+        self.deactivate_redo()
         self.is_lost = False
         self.has_info = False
         self.is_solving = False
@@ -100,6 +105,13 @@ class GameInterface:
             callback=self.game.cancel_move
         )
 
+        self.txtRedo = Text(
+            "Refaire le coup annulé (Y)",
+            self.font_messages, C.GREY, C.ARIGHT, C.ACUSTOM,
+            below=self.txtCancel,
+            callback=self.game.redo_move
+        )
+
         self.txtReset = Text(
             "Recommencer le niveau (R)",
             self.font_messages, C.BLACK, C.ACENTER, C.ATOP,
@@ -191,6 +203,7 @@ class GameInterface:
 
         self.clickableTexts = [
             self.txtCancel,
+            self.txtRedo,
             self.txtReset,
             self.txtTest,
             # START_CUT
@@ -252,6 +265,12 @@ class GameInterface:
     def deactivate_cancel(self):
         self.txtCancel.change_color(C.GREY)
 
+    def activate_redo(self):
+        self.txtRedo.change_color(C.BLACK)
+
+    def deactivate_redo(self):
+        self.txtRedo.change_color(C.GREY)
+
     def best_moves(self, best):
         if best is None:
             self.txtBestMoves.update("Meilleur : infini")
@@ -528,6 +547,48 @@ class Game:
         # check if last push triggered a win condition
         if self.level.has_win():
             self.level_win()
+
+    def solve_in_background(self, task, *args):
+        """
+        Run a solving task ('all', 'one' or 'move' with their arguments) in
+        a worker process, while the window keeps being updated at
+        TARGET_FPS. 'Escape' cancels the search.
+        Return (found, message, path) as the solving methods of the level.
+        """
+        budget = Budget(C.SOLVE_TIME_BUDGET, C.SOLVE_NODE_BUDGET,
+                        C.SOLVE_MEMORY_BUDGET)
+        if task == 'all' and C.PORTFOLIO:
+            solver = PortfolioSolver(self.level, S.scores.index_level,
+                                     mode_configs(C.SOLVE_MODE),
+                                     budget=budget)
+        elif task == 'all':
+            solver = BackgroundSolver(self.level, S.scores.index_level,
+                                      task, mode=C.SOLVE_MODE, budget=budget)
+        else:
+            solver = BackgroundSolver(self.level, S.scores.index_level,
+                                      task, *args, budget=budget)
+        while solver.result is None:
+            self.clock.tick(C.TARGET_FPS)
+
+            progress = solver.poll()
+            if progress is not None:
+                explored, elapsed = progress
+                message = MSG_SOLVE.format(exp=explored, el=elapsed,
+                                           sp=explored/elapsed)
+                self.interface.set_solving(True, message=message)
+
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    solver.stop()
+                    pygame.quit()
+                    sys.exit(0)
+                if event.type == KEYDOWN and event.key == K_ESCAPE:
+                    solver.cancel()
+
+            self.update_screen()
+
+        solver.stop()
+        return solver.result
 # END_CUT
 
     def cancel_selected(self):
@@ -538,6 +599,24 @@ class Game:
         remaining = self.level.cancel_last_change()
         if not remaining:
             self.interface.deactivate_cancel()
+        if self.level.has_redo():
+            self.interface.activate_redo()
+# START_CUT
+        lost = self.level.lost_state()
+        if lost:
+            verbose("Still lost state !")
+        self.interface.set_lost_state(lost)
+# END_CUT
+
+    def redo_move(self):
+        remaining = self.level.redo_last_change()
+        if not remaining:
+            self.interface.deactivate_redo()
+        if self.level.has_cancelable():
+            self.interface.activate_cancel()
+        if self.level.has_win():
+            self.level_win()
+            return
 # START_CUT
         lost = self.level.lost_state()
         if lost:
@@ -580,6 +659,10 @@ class Game:
                 # Cancel last move
                 self.cancel_move()
 
+            elif event.key == K_y:
+                # Redo last cancelled move
+                self.redo_move()
+
             # "Test" key
             elif event.key == K_t:
                 # Add code here that you would like to trigger with the 'T' key
@@ -590,7 +673,7 @@ class Game:
             # "all box solve" key
             elif event.key == K_a:
                 self.interface.set_solving(True, num=0)
-                found, message, path = self.level.solve_all_boxes()
+                found, message, path = self.solve_in_background('all')
                 if not found:
                     self.interface.set_solving(
                         True,
@@ -659,9 +742,11 @@ class Game:
         status = self.character.start_move(direction)
 
         # after a box has been moved, the 'cancel' button becomes
-        # available
+        # available, and cancelled moves cannot be redone anymore
         if self.level.has_cancelable():
             self.interface.activate_cancel()
+        if not self.level.has_redo():
+            self.interface.deactivate_redo()
 
         # move failed (e.g., character against a wall)
         if status == C.ST_IDLE:
@@ -726,8 +811,11 @@ class Game:
                         break
 
 # START_CUT
-                    # or if position is lost...
-                    lost = self.level.lost_state()
+                    # or if position is lost... all boxes are checked, as
+                    # pushing another box must not clear the lost state;
+                    # closed areas are only detected around the pushed box
+                    lost = self.level.lost_state() or \
+                        self.level.lost_state(pushed=self.level.pushed_box)
                     if lost:
                         verbose("Lost state !")
                     self.interface.set_lost_state(lost)
@@ -764,11 +852,12 @@ class Game:
                 # now try to move the box
                 if position == selpos:
                     # same position: auto solving this box to a target
-                    found, message, path = self.level.solve_one_box(selpos)
+                    found, message, path = self.solve_in_background(
+                        'one', selpos)
                 else:
                     # different position: move the box to this area
-                    found, message, path = self.level.move_one_box(
-                        selpos, position)
+                    found, message, path = self.solve_in_background(
+                        'move', selpos, position)
 
                 self.interface.set_solving(
                     True,
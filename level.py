@@ -1,17 +1,27 @@
 """
 Handles the reading of levels from pack files,
 as well as the state of the level when playing the game
-- map of whole level: floor, walls, targets
+- board of whole level: floor, walls, targets and boxes
 - player position
 - position of boxes
+The board is flat, cell (x, y) is at index y*width + x, with bit flags
+C.CELL_* for its content.
 """
 
 import os
 import pygame
 import common as C
-from copy import deepcopy
+from array import array
+import pack_index
+import compiled_level
 from explore import *
 from utils import *
+# START_CUT
+import hashlib
+import json
+import solution_cache
+from static_level import StaticLevel
+# END_CUT
 
 
 class Level:
@@ -23,22 +33,23 @@ class Level:
         self.game = game
         self.num_moves = 0
 # START_CUT
-        self.dij = None
+        self.reach = None
+        self.att_valid = False
+        # last search done by a solving method, None if the solution came
+        # from the cache
+        self.search = None
 # END_CUT
         self.filename = filename
-        self.level_lines = []
         self.level_number = 0
-        self.load_file()    # read whole file
+        self.load_file()    # index of the levels in the file
         self.loaded = False  # True when a level is loaded
         self.pushed_box = None
 
     def place_box(self, box):
-        x, y = box
-        self.mboxes[y][x] = True
+        self.board[self.index(box)] |= C.CELL_BOX
 
     def clear_box(self, box):
-        x, y = box
-        self.mboxes[y][x] = False
+        self.board[self.index(box)] &= ~C.CELL_BOX
 
     def set_player(self, p):
         verbose('player set at', p)
@@ -46,257 +57,228 @@ class Level:
 
     def parse_rows(self, rows, symbols):
 
-        self.map = []
-        max_width = 0
+        rows = [r for r in rows if r != '']
         self.boxes = []
         self.targets = []
-        height = len(rows)
-
-        for y in range(len(rows)):
-            level_row = []
-            if rows[y] == '':
-                height -= 1
-                continue
-            if len(rows[y]) > max_width:
-                max_width = len(rows[y])
+        self.width = max(len(r) for r in rows)
+        self.height = len(rows)
+        # cells beyond the end of a row are left empty (air)
+        self.board = bytearray(self.width * self.height)
 
+        for y in range(self.height):
             for x in range(len(rows[y])):
                 block = symbols.index(rows[y][x])
-                level_row.append(block)
-
-                if block == C.BOX:
-                    level_row[-1] = C.GROUND
-                    self.boxes.append((x, y))
-
-                elif block == C.TARGET:
-                    self.targets.append((x, y))
+                flags = C.BLOCK_FLAGS[block]
+                self.board[y*self.width + x] = flags
 
-                elif block == C.TARGET_FILLED:
-                    level_row[-1] = C.TARGET
+                if flags & C.CELL_BOX:
                     self.boxes.append((x, y))
+                if flags & C.CELL_TARGET:
                     self.targets.append((x, y))
-
-                elif block == C.PLAYER:
-                    level_row[-1] = C.GROUND
-                    self.player_position = (x, y)
-
-                elif block == C.PLAYER_ON_TARGET:
-                    level_row[-1] = C.TARGET
-                    self.targets.append((x, y))
+                if block in (C.PLAYER, C.PLAYER_ON_TARGET):
                     self.player_position = (x, y)
 
-            self.map.append(level_row)
-
-        self.width = max_width
-        self.height = height
-
-        for y in range(height):
-            while len(self.map[y]) < max_width:
-                self.map[y].append(C.AIR)
-
-        # map of boxes
-        self.mboxes = [[False for x in range(self.width)]
-                       for y in range(self.height)]
-        for bx, by in self.boxes:
-            self.mboxes[by][bx] = True
+        # offset of the neighbour of a cell in each direction
+        self.offsets = tuple(dx + dy*self.width for dx, dy in C.DIRS)
 
         verbose("Level size: ", self.width, "x", self.height)
-        verbose(self.map)
-        verbose(self.mboxes)
+        verbose(self.board)
         verbose(self.boxes)
 
     def load_file(self):
         """
-        Load a pack of sokoban levels.
-        Does not create all levels but stores the corresponding lines so
-        as to be able to load a particular level later.
+        Load the index of a pack of sokoban levels (see pack_index).
+        Does not read the levels, a particular level is read from the file
+        when it is loaded.
         """
+        self.pack = pack_index.get_index(
+            os.path.join('assets', 'levels', self.filename))
 
-        verbose('Reading file', self.filename)
-        with open(os.path.join('assets', 'levels', self.filename)) as level_file:
-            # prefers that to readlines() as there is not trailing "\n"
-            rows = level_file.read().splitlines()
+    def num_levels(self):
+        return len(self.pack)
 
-        num = 0
-        lev = []
-        current = []
-        title = None
-
-        for r in rows:
-            if r == '':
-                # end of level
-                if current != []:
-                    lev.append((title, current))
-                    current = []
-                    title = None
-                continue
-
-            if r[0] == ';':
-                continue
-
-            if r.startswith('Title: '):
-                title = r[7:]
-
-            # check if this is a valid line:
-            if not valid_soko_line(r):
-                continue
+    def compile(self, levelnum):
+        """
+        Read level 'levelnum' from the pack and analyse it, as a
+        CompiledLevel.
+        """
+        rows = self.pack.rows(levelnum)
+        self.parse_rows(rows, C.SYMBOLS_ORIGINALS)
 
-            current.append(r)  # row belongs to level
+        # Use DFS to mark the interior floor as ground
+        dfs = DFS(self)
+        mark = dfs.search_floor(self.player_position)
+        for i, m in enumerate(mark):
+            if m:
+                self.board[i] |= C.CELL_FLOOR
 
-        self.level_lines = lev
+        dead = None
+# START_CUT
+        # compute deadlocks
+        self.compute_dead()
+        dead = self.dead
+# END_CUT
+        return compiled_level.CompiledLevel(
+            self.pack.title(levelnum), self.width, self.height, self.board,
+            self.boxes, self.targets, self.player_position, mark, dead)
 
     def load(self, levelnum):
         self.loaded = False
 
-        if levelnum > len(self.level_lines):
+        if levelnum > len(self.pack):
             return False
 
-        self.title, rows = self.level_lines[levelnum-1]
-        self.parse_rows(rows, C.SYMBOLS_ORIGINALS)
+        # restarting or coming back to a level only copies it
+        compiled = compiled_level.get(self.pack, levelnum)
+        if compiled is None:
+            compiled = self.compile(levelnum)
+            compiled_level.put(self.pack, levelnum, compiled)
+
+        self.title = compiled.title
+        self.width = compiled.width
+        self.height = compiled.height
+        self.board = bytearray(compiled.board)
+        self.targets = list(compiled.targets)
+        self.player_position = compiled.player
+        self.offsets = tuple(dx + dy*self.width for dx, dy in C.DIRS)
+
+        # index in self.boxes of the box on each cell, -1 if none
+        self.boxes = []
+        self.box_ids = array('i', [-1]) * len(self.board)
+        self.set_boxes(compiled.boxes)
+        mark = compiled.interior
 
-        # Use DFS to mark the interior floor as ground
-        dfs = DFS(self)
-        mark = dfs.search_floor(self.player_position)
-        for y in range(self.height):
-            for x in range(self.width):
-                if mark[y][x]:
-                    if self.map[y][x] == C.AIR:
-                        self.map[y][x] = C.GROUND
+# START_CUT
+        # the analyses only depend on the compiled level: restarting or
+        # coming back to a level reuses them
+        self.dead = compiled.dead
+        if compiled.analysis is None:
+            compiled.analysis = self.analyse(mark)
+        (self.floor, self.floor_index, self.neighbours, self.push_dist,
+         self.macros, self.static, self.layout, self.origin) = \
+            compiled.analysis
 
-# START_CUT        #
         # reset previous analyses
-        self.dij = None
-
-        # compute deadlocks
-        self.compute_dead()
+        self.reach = Reach(self)
+        self.att_valid = False
 
 # END_CUT
         # highlight on some tiles
-        self.mhighlight = [[C.HOFF for x in range(
-            self.width)] for y in range(self.height)]
+        self.mhighlight = bytearray(len(self.board))
 
-        # no previous move to cancel
-        self.state_stack = []
+        # no previous move to cancel or redo: each push is logged as the
+        # cells of the player before it and of the box before and after it,
+        # and the number of moves before it
+        self.undo_log = array('i')
+        self.redo_log = array('i')
         self.num_moves = 0
         self.loaded = True
         return True
 
     def reset_highlight(self):
-        for y in range(self.height):
-            for x in range(self.width):
-                self.mhighlight[y][x] = C.HOFF
+        self.mhighlight[:] = bytes(len(self.mhighlight))
 
     def highlight(self, positions, htype=C.HATT):
-        for x, y in positions:
-            self.mhighlight[y][x] = htype
+        for pos in positions:
+            self.mhighlight[self.index(pos)] = htype
 
     # Some helper functions to check the state of a tile
 
-    def has_box(self, pos):
+    def index(self, pos):
         x, y = pos
-        return self.mboxes[y][x]
+        return y*self.width + x
+
+    def position(self, i):
+        return (i % self.width, i // self.width)
+
+    def has_box(self, pos):
+        return self.board[self.index(pos)] & C.CELL_BOX != 0
+
+    def box_id(self, pos):
+        """
+        Index in self.boxes of the box at 'pos', -1 if there is none.
+        A box keeps its index when pushed.
+        """
+        return self.box_ids[self.index(pos)]
 
     def is_target(self, pos):
-        x, y = pos
-        return self.map[y][x] in [C.TARGET, C.TARGET_FILLED]
+        return self.board[self.index(pos)] & C.CELL_TARGET != 0
 
     def is_wall(self, pos):
-        x, y = pos
-        return self.map[y][x] == C.WALL
+        return self.board[self.index(pos)] & C.CELL_WALL != 0
 
     def is_floor(self, pos):
-        x, y = pos
-        return self.map[y][x] in [C.GROUND, C.TARGET, C.PLAYER]
+        return self.board[self.index(pos)] & C.CELL_FLOOR != 0
 
     def is_empty(self, pos):
-        return self.is_floor(pos) and not self.has_box(pos)
+        return self.board[self.index(pos)] & (C.CELL_FLOOR | C.CELL_BOX) \
+            == C.CELL_FLOOR
 
 # START_CUT
     def is_dead(self, pos):
-        x, y = pos
-        return self.dead[y][x]
-
-    def lost_state(self, mboxes=None, boxlist=None):
-        """
-        Some heuristics to determine if the level is now in an
-        unsolvable state:
-        - box along a unescapable wall without target
-        - boxes forming a square
-        - in general, box that can no longer reach any target
-        """
-        if mboxes is None:
-            mboxes = self.mboxes
-        if boxlist is None:
-            boxlist = self.boxes
-
-        def is_full(p):
-            x, y = p
-            return self.is_wall(p) or mboxes[y][x]
-
-        # check if some boxes are in wall corners
-        for box in boxlist:
-            # print ('cheking', box)
-            # disp = False
-            # if box == (10,5):
-            # disp=True
-            # print ("TESTISANOGEU")
-
-            if self.is_target(box):
-                continue
-            if self.is_dead(box):
-                return True
-            prev = False
-            for d in C.AROUND:
-                # if disp:
-                # print ("cheking", C.DNAMES[d])
-                side = in_dir(box, d)
-                blocked = self.is_wall(side)
-                if prev and blocked:
-                    return True
-                # WARNING: do not check with has_box, since it may be on
-                # a different state of boxes
-                x, y = side
-                if mboxes[y][x]:
-                    # if disp:
-                    # print ("there is a box copain", x,y)
-                    # check if close to a wall
-                    if horizontal(d):
-                        d1 = C.UP
-                        d2 = C.DOWN
-                    else:
-                        d1 = C.LEFT
-                        d2 = C.RIGHT
-                        # check above and below
-                    ub = in_dir(box, d1)
-                    us = in_dir(side, d1)
-                    db = in_dir(box, d2)
-                    ds = in_dir(side, d2)
-                    if is_full(ub) and is_full(us)\
-                            or is_full(db) and is_full(ds):
-                        return True
-
-                prev = blocked
-
-        return False
+        return self.dead[self.index(pos)] != 0
+
+    def lost_state(self, pushed=None):
+        """
+        Check if the level is now in an unsolvable state, see
+        StaticLevel.lost. If 'pushed' is given, only the box last pushed to
+        this position is checked, as the other boxes have been checked
+        already.
+        """
+        fi = self.floor_index
+        boxes = bitboard(fi[b] for b in self.boxes)
+        if pushed is not None:
+            pushed = fi[pushed]
+        return self.static.lost(boxes, fi[self.player_position], pushed)
 # END_CUT
 
     def get_current_state(self):
-        return {'mboxes': deepcopy(self.mboxes),
+        return {'boxes': list(self.boxes),
                 'player': self.player_position,
                 'moves': self.num_moves,
                 }
 
+    def set_boxes(self, boxes):
+        """
+        Place the boxes on positions 'boxes', and only there.
+        """
+        for box in self.boxes:
+            i = self.index(box)
+            self.board[i] &= ~C.CELL_BOX
+            self.box_ids[i] = -1
+        self.boxes = list(boxes)
+        for n, box in enumerate(self.boxes):
+            i = self.index(box)
+            self.board[i] |= C.CELL_BOX
+            self.box_ids[i] = n
+
     def restore_state(self, state):
-        self.mboxes = state['mboxes']
-        self.update_box_positions()
+        self.set_boxes(state['boxes'])
         self.player_position = state['player']
         self.num_moves = state['moves']
 # START_CUT
         self.invalidate()
 # END_CUT
 
-    def push_state(self):
-        self.state_stack.append(self.get_current_state())
+    def log_push(self, box, dest):
+        """
+        Log the push of the box on cell 'box' to cell 'dest' of the board,
+        about to be done. Pushes cancelled before cannot be redone anymore.
+        """
+        self.undo_log.extend((self.index(self.player_position), box, dest,
+                              self.num_moves))
+        del self.redo_log[:]
+
+    def move_box(self, source, dest):
+        """
+        Move the box on cell 'source' of the board to cell 'dest'.
+        """
+        self.board[source] &= ~C.CELL_BOX
+        self.board[dest] |= C.CELL_BOX
+        boxi = self.box_ids[source]
+        self.box_ids[source] = -1
+        self.box_ids[dest] = boxi
+        self.boxes[boxi] = self.position(dest)
 
     def move_player(self, direction):
         """
@@ -323,82 +305,76 @@ class Level:
            yy < 0 or yy >= self.height:
             return
 
-        if self.is_empty((xx, yy)):
+        board = self.board
+        empty = C.CELL_FLOOR | C.CELL_BOX
+        # cells next to the player and after it, on the flat board
+        i = yy*self.width + xx
+        i2 = i + move_x + move_y*self.width
+
+        if board[i] & empty == C.CELL_FLOOR:
             # Player just moved on an empty cell
             self.player_position = (xx, yy)
             player_status = C.ST_MOVING
 
-        elif self.has_box((xx, yy)) and self.is_empty((xx2, yy2)):
+        elif board[i] & C.CELL_BOX and board[i2] & empty == C.CELL_FLOOR:
             # Player is trying to push a box
             self.pushed_box = (xx2, yy2)
 
             player_status = C.ST_PUSHING
 
             # Save current state
-            self.push_state()
-
-            boxi = self.boxes.index((xx, yy))
-            self.boxes[boxi] = (xx2, yy2)
-
-            self.mboxes[yy][xx] = False
-            self.mboxes[yy2][xx2] = True
+            self.log_push(i, i2)
+            self.move_box(i, i2)
 
             self.player_position = (xx, yy)
 
-        if player_status != C.ST_IDLE:
-            # START_CUT
-            self.invalidate()
+# START_CUT
+            if self.att_valid:
+                # only one box moved: update attainable area incrementally
+                self.reach.push(self.floor_index[(xx, yy)],
+                                self.floor_index[(xx2, yy2)])
 # END_CUT
+
+        if player_status != C.ST_IDLE:
             self.num_moves += 1
+            # the log does not count the moves walked since an undo: the
+            # cancelled pushes cannot be redone anymore
+            del self.redo_log[:]
 
         return player_status
 
     def hide_pushed_box(self):
-        x, y = self.pushed_box
-        self.mboxes[y][x] = False
+        self.clear_box(self.pushed_box)
 
     def show_pushed_box(self):
-        x, y = self.pushed_box
-        self.mboxes[y][x] = True
+        self.place_box(self.pushed_box)
 
 
 # START_CUT
 
-    def compute_attainable(self, virtual=False):
-        if virtual:
-            locdij = Dijkstra(self)
-            locdij.attainable(self.player_position)
-            return locdij.get_marks()
-
-        if not self.dij:
-            self.dij = Dijkstra(self)
-            self.dij.attainable(self.player_position)
-            return self.dij.get_marks()
-
-    def box_attainable_sides(self, boxlist, virtual=False):
+    def compute_attainable(self):
         """
-        if virtual, do not erase existing Dijkstra calculation
+        Compute the tiles attainable by the player, unless the previous
+        computation is still valid.
         """
+        if not self.att_valid:
+            self.reach.load_boxes(self.floor_index[b] for b in self.boxes)
+            self.reach.flood(self.floor_index[self.player_position])
+            self.att_valid = True
+        return self.reach
 
-        mark = self.compute_attainable(virtual)
-        l = []
-        for bx, by in boxlist:
-            sides = [False for d in C.DIRS]
-            for d, (mx, my) in enumerate(C.DIRS):
-                if mark[by+my][bx+mx]:
-                    sides[d] = True
-            l.append(tuple(sides))
-        return tuple(l)
+    def is_attainable(self, pos):
+        i = self.floor_index.get(pos)
+        return i is not None and self.reach.is_marked(i)
 
     def compute_box_successors(self, boxpos):
         assert(self.has_box(boxpos))
 
         self.compute_attainable()
-        mark = self.dij.get_marks()
         succ = []
         bx, by = boxpos
         for mx, my in C.DIRS:
-            if mark[by+my][bx+mx] \
+            if self.is_attainable((bx+mx, by+my)) \
                     and self.is_empty((bx-mx, by-my)):
                 # side is attainable
                 # and opposite side is free
@@ -407,11 +383,10 @@ class Level:
 
     def compute_boxes_successors(self):
         self.compute_attainable()
-        mark = self.dij.get_marks()
         succ = []
         for bx, by in self.boxes:
             for mx, my in C.DIRS:
-                if mark[by+my][bx+mx] \
+                if self.is_attainable((bx+mx, by+my)) \
                         and self.is_empty((bx-mx, by-my)):
                     # side is attainable
                     # and opposite side is free
@@ -420,32 +395,219 @@ class Level:
 
     def path_to(self, dest):
         self.compute_attainable()
-        if not self.dij.is_marked(dest):
+        if not self.is_attainable(dest):
             verbose("area is not attainable...")
             return None
 
-        path = self.dij.shortest_path(self.player_position, dest)
+        # distances are only valid from the position of the last search
+        player = self.floor_index[self.player_position]
+        if not self.reach.has_dist or self.reach.source != player:
+            self.reach.flood(player)
+
+        path = self.reach.shortest_path(self.floor_index[dest])
         return path
 
-    def solve_all_boxes(self):
-        verbose("Solving for all boxes!")
-        bs = BoxSolution(self, self.boxes)
-        return bs.solve()
+    def analyse(self, mark):
+        """
+        Structures of the level as loaded needed by the solver, from the
+        interior cells in 'mark': interior cells numbered with their
+        neighbours, push distances, macro pushes, static level, and layout
+        for the solution cache. Kept with the compiled level.
+        """
+        # number the interior cells, used by the solver for compact states
+        # (with boxes and targets walled in outside of the interior)
+        self.floor = []
+        self.floor_index = {}
+        for i, cell in enumerate(self.board):
+            if mark[i] or cell & (C.CELL_BOX | C.CELL_TARGET):
+                pos = self.position(i)
+                self.floor_index[pos] = len(self.floor)
+                self.floor.append(pos)
+
+        # flat neighbour table of the interior cells: the neighbour of cell
+        # i in direction d is neighbours[4*i+d], or -1 if it is a wall
+        self.neighbours = []
+        for pos in self.floor:
+            for d in range(C.NUMDIRS):
+                n = self.floor_index.get(in_dir(pos, d), -1)
+                self.neighbours.append(n)
+
+        # number of pushes from each cell to each target
+        self.push_dist = PushDistances(self).compute()
+
+        # tunnels and goal rooms, for macro pushes
+        self.macros = Macros(self).compute()
+
+        # all the solver needs, apart from the positions of boxes and player
+        self.static = StaticLevel(self)
+
+        # identifies the level in the solution cache, whatever its pack
+        self.compute_layout()
+        return (self.floor, self.floor_index, self.neighbours,
+                self.push_dist, self.macros, self.static, self.layout,
+                self.origin)
+
+    def compute_layout(self):
+        """
+        Hash of the walls and targets of the level, without boxes nor
+        player, and without the empty margins of the pack file. Positions
+        in the solution cache are relative to 'origin', the top-left
+        corner of the hashed area.
+        """
+        rows = []
+        w = self.width
+        for y in range(self.height):
+            row = ''.join('#' if cell & C.CELL_WALL
+                          else '.' if cell & C.CELL_TARGET else ' '
+                          for cell in self.board[y*w:(y+1)*w])
+            rows.append(row.rstrip())
+        top = 0
+        while not rows[top]:
+            top += 1
+        left = min(len(r) - len(r.lstrip()) for r in rows if r)
+        text = '\n'.join(r[left:] for r in rows[top:]).rstrip()
+        self.layout = hashlib.sha1(text.encode()).hexdigest()
+        self.origin = (left, top)
+
+    def relative(self, pos, sign=-1):
+        return (pos[0] + sign*self.origin[0], pos[1] + sign*self.origin[1])
+
+    def solution_key(self, task, *args):
+        """
+        Key of the current position in the solution cache, for task 'all'
+        (see explore.solution_task), 'one' or 'move' with its positions.
+        The player is represented by the top-left cell of its area, all its
+        cells being equivalent, but for moves-optimal solutions whose
+        number of moves depends on its exact cell.
+        """
+        if task == solution_task('moves'):
+            player = self.player_position
+        else:
+            player = self.floor[self.compute_attainable().top]
+        boxes = sorted(self.relative(b) for b in self.boxes)
+        return json.dumps([self.layout, task, boxes, self.relative(player)]
+                          + [self.relative(pos) for pos in args])
+
+    def cached_solution(self, key):
+        cached = solution_cache.get_cache().get(key)
+        if cached is None:
+            return None
+        verbose("Solution found in cache")
+        path = [(self.relative(box, 1), d) for box, d in cached[0]]
+        # stored moves may start from another cell of the player's area
+        moves = self.solution_moves(path)
+        if moves is None:
+            return None
+        message = "Solution trouvée dans le cache ({} poussées, {} " \
+            "déplacements)".format(len(path), len(moves))
+        return (True, message, path)
+
+    def cache_entry(self, path, moves=None):
+        """
+        Pushes and moves of a solution found from the current position,
+        as stored in the solution cache.
+        """
+        if moves is None:
+            moves = self.solution_moves(path)
+        return [(self.relative(box), d) for box, d in path], moves
+
+    def store_solution(self, key, path):
+        pushes, moves = self.cache_entry(path)
+        if moves is None:
+            # cannot be replayed, not worth keeping
+            return
+        solution_cache.get_cache().put(key, pushes, moves)
+
+    def solve_all_boxes(self, progress=None, bidirectional=False,
+                        engine='astar', mode='weighted', cached=True,
+                        **options):
+        """
+        Solve the level from the current position with the search engine
+        named 'engine' in search mode 'mode' (see explore.MODES), other
+        options are given to this engine.
+        The solution cache is not used if 'cached' is False.
+        """
+        key = self.solution_key(solution_task(mode))
+        self.search = None
+        if cached:
+            solution = self.cached_solution(key)
+            if solution is not None:
+                return solution
+
+        verbose("Solving for all boxes with", engine)
+        bs = ENGINES[engine](self, self.boxes, progress=progress,
+                             bidirectional=bidirectional, mode=mode,
+                             **options)
+        self.search = bs
+        found, message, path = bs.solve()
+        if found and cached:
+            self.store_solution(key, path)
+        return (found, message, path)
+
+    def solve_one_box(self, source, progress=None, budget=None):
+        key = self.solution_key('one', source)
+        self.search = None
+        cached = self.cached_solution(key)
+        if cached is not None:
+            return cached
 
-    def solve_one_box(self, source):
         verbose("Moving one box from", source, "to any target")
-        bs = BoxSolution(self, [source])
+        bs = BoxSolution(self, [source], progress=progress, budget=budget)
+        self.search = bs
         found, message, path = bs.solve()
         if path is not None:
-            pass
-            # trying to improve last steps
+            # trying to improve last steps, counted again
             bs.improve()
+            message = message[:message.rindex(" (")] + bs.count_path(bs.path)
+        if found:
+            self.store_solution(key, bs.path)
         return (found, message, bs.path)
 
-    def move_one_box(self, source, dest):
+    def move_one_box(self, source, dest, progress=None, budget=None):
+        key = self.solution_key('move', source, dest)
+        self.search = None
+        cached = self.cached_solution(key)
+        if cached is not None:
+            return cached
+
         verbose("Moving one box from", source, "to", dest)
-        bs = BoxSolution(self, [source], dest=dest)
-        return bs.solve()
+        bs = BoxSolution(self, [source], dest=dest, progress=progress,
+                         budget=budget)
+        self.search = bs
+        found, message, path = bs.solve()
+        if found:
+            self.store_solution(key, path)
+        return (found, message, path)
+
+    def solution_moves(self, path):
+        """
+        Replay a list of box pushes from the current state, and return the
+        corresponding moves in LURD notation (uppercase for pushes).
+        Return None if the player cannot reach the side of a push.
+        The level is restored afterwards.
+        """
+        save = self.get_current_state()
+        save_logs = self.undo_log, self.redo_log
+        self.undo_log, self.redo_log = array('i'), array('i')
+
+        moves = []
+        for box, d in path:
+            walk = self.path_to(self.side_box(box, d))
+            if walk is None:
+                moves = None
+                break
+            for m in walk:
+                self.move_player(C.DIRS[m])
+                moves.append(C.LURD[m])
+            push = opposite(d)
+            self.move_player(C.DIRS[push])
+            moves.append(C.LURD[push].upper())
+
+        self.undo_log, self.redo_log = save_logs
+        self.restore_state(save)
+        if moves is None:
+            return None
+        return ''.join(moves)
 
     def side_box(self, box, d):
         bx, by = box
@@ -460,42 +622,72 @@ class Level:
         self.reset_highlight()
 
         self.compute_attainable()
-        self.highlight(self.dij.att_list, C.HATT)
+        self.highlight([self.floor[i] for i in self.reach.cells], C.HATT)
 
         succ = self.compute_boxes_successors()
         self.highlight(succ, C.HSUCC)
 
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.dead[y][x] and self.is_floor((x, y)):
-                    self.highlight([(x, y)], C.HERROR)
+        for i, cell in enumerate(self.board):
+            if self.dead[i] and cell & C.CELL_FLOOR:
+                self.mhighlight[i] = C.HERROR
 
     def invalidate(self):
-        self.dij = None
+        self.att_valid = False
 # END_CUT
 
-    def update_box_positions(self):
-        self.boxes = []
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.mboxes[y][x]:
-                    self.boxes.append((x, y))
-
     def cancel_last_change(self):
         """
+        Go back to the position before the last push, which can be redone.
         Return True if there is still cancelable moves
         """
 
-        if not self.state_stack:
+        if not self.undo_log:
             verbose("No previous state")
             return False
 
-        state = self.state_stack.pop()
-        self.restore_state(state)
-        return self.state_stack != []
+        entry = self.undo_log[-4:]
+        del self.undo_log[-4:]
+        self.redo_log.extend(entry)
+
+        player, box, dest, moves = entry
+        self.move_box(dest, box)
+        self.player_position = self.position(player)
+        self.num_moves = moves
+# START_CUT
+        self.invalidate()
+# END_CUT
+        return len(self.undo_log) > 0
+
+    def redo_last_change(self):
+        """
+        Push again the box of the last cancelled push, if the player has not
+        moved since it was cancelled.
+        Return True if there is still moves to redo
+        """
+
+        if not self.redo_log:
+            verbose("No cancelled move")
+            return False
+
+        entry = self.redo_log[-4:]
+        del self.redo_log[-4:]
+        self.undo_log.extend(entry)
+
+        player, box, dest, moves = entry
+        self.move_box(box, dest)
+        self.pushed_box = self.position(dest)
+        self.player_position = self.position(box)
+        self.num_moves = moves + 1
+# START_CUT
+        self.invalidate()
+# END_CUT
+        return len(self.redo_log) > 0
 
     def has_cancelable(self):
-        return self.state_stack != []
+        return len(self.undo_log) > 0
+
+    def has_redo(self):
+        return len(self.redo_log) > 0
 
     def has_win(self):
         for b in self.boxes:
@@ -509,21 +701,24 @@ class Level:
         Some tiles might be highlighted.
         """
 
-        for y in range(self.height):
-            for x in range(self.width):
-                pos = (x * C.SPRITESIZE, y * C.SPRITESIZE)
-
-                if self.mboxes[y][x]:
-                    if self.is_target((x, y)):
-                        window.blit(textures[C.TARGET_FILLED], pos)
-                    else:
-                        window.blit(textures[C.BOX], pos)
-
-                elif self.map[y][x] in textures:
-                    window.blit(textures[self.map[y][x]], pos)
-                    if self.is_target((x, y)):
-                        window.blit(textures[C.TARGETOVER], pos)
-
-                h = self.mhighlight[y][x]
-                if h:
-                    window.blit(highlights[C.SPRITESIZE][h], pos)
+        w = self.width
+        for i, cell in enumerate(self.board):
+            pos = ((i % w) * C.SPRITESIZE, (i // w) * C.SPRITESIZE)
+
+            if cell & C.CELL_BOX:
+                if cell & C.CELL_TARGET:
+                    window.blit(textures[C.TARGET_FILLED], pos)
+                else:
+                    window.blit(textures[C.BOX], pos)
+
+            elif cell & C.CELL_WALL:
+                window.blit(textures[C.WALL], pos)
+
+            elif cell & C.CELL_FLOOR:
+                window.blit(textures[C.GROUND], pos)
+                if cell & C.CELL_TARGET:
+                    window.blit(textures[C.TARGETOVER], pos)
+
+            h = self.mhighlight[i]
+            if h:
+                window.blit(highlights[C.SPRITESIZE][h], pos)
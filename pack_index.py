@@ -0,0 +1,145 @@
+"""
+Index of the levels of a pack file: where each level is in the file, and
+its title. A level is then read and parsed alone, without going through the
+whole pack, which matters for the large collections (over a thousand levels
+for Sven_1623.xsb).
+The index is stored next to the pack, and computed again when the pack
+changes (other modification time or size).
+"""
+
+import os
+import json
+import mmap
+from utils import *
+
+# the index of pack 'name' is stored in 'name.idx'
+SUFFIX = '.idx'
+VERSION = 1
+
+# global variable, as for scores: indexes by path of their pack
+indexes = {}
+
+
+def get_index(path):
+    """
+    Index of the pack file at 'path', read once and shared by all levels.
+    """
+    stat = os.stat(path)
+    index = indexes.get(path)
+    if index is None or not index.matches(stat):
+        index = PackIndex(path, stat)
+        indexes[path] = index
+    return index
+
+
+class PackIndex:
+    """
+    Levels of a pack as (offset, length, title): the bytes from 'offset'
+    to 'offset+length' of the file hold the rows of the level.
+    Levels are numbered from 1, as in the game.
+    """
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        if not self.load(path + SUFFIX):
+            self.build()
+            self.save(path + SUFFIX)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def matches(self, stat):
+        return stat.st_mtime_ns == self.mtime and stat.st_size == self.size
+
+    def load(self, filename):
+        """
+        Read the index stored in 'filename', if it is still the one of the
+        pack. Return False if it has to be computed again.
+        """
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != VERSION or data.get('mtime') != self.mtime \
+                or data.get('size') != self.size:
+            return False
+        self.levels = [tuple(entry) for entry in data['levels']]
+        return True
+
+    def save(self, filename):
+        # written aside then renamed, not to leave a truncated file
+        data = {
+            'version': VERSION,
+            'mtime': self.mtime,
+            'size': self.size,
+            'levels': self.levels,
+        }
+        tmp = filename + '.' + str(os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, filename)
+        except OSError as e:
+            # read-only pack directory: the index is computed each time
+            verbose("Cannot save the index of", self.path, e)
+
+    def build(self):
+        """
+        Go once through the whole pack. Levels are separated by empty
+        lines, comments start with ';', and rows of a level start with
+        spaces then a wall; the title is given on a line 'Title: ...'.
+        """
+        verbose('Indexing file', self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        self.levels = []
+        offset = 0
+        start = end = None
+        title = None
+
+        for line in data.splitlines(keepends=True):
+            pos = offset
+            offset += len(line)
+            r = line.rstrip(b'\r\n').decode('utf-8', 'replace')
+
+            if r == '':
+                # end of level
+                if start is not None:
+                    self.levels.append((start, end - start, title))
+                    start = None
+                    title = None
+                continue
+
+            if r[0] == ';':
+                continue
+
+            if r.startswith('Title: '):
+                title = r[7:]
+
+            if not valid_soko_line(r):
+                continue
+
+            # row belongs to level
+            if start is None:
+                start = pos
+            end = pos + len(line)
+
+    def title(self, levelnum):
+        return self.levels[levelnum-1][2]
+
+    def rows(self, levelnum):
+        """
+        Rows of level 'levelnum', read from the file without the other
+        levels.
+        """
+        offset, length, _ = self.levels[levelnum-1]
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                data = m[offset:offset+length]
+        lines = data.decode('utf-8', 'replace').splitlines()
+        # comments or other lines in the middle of the level
+        return [r for r in lines if valid_soko_line(r)]
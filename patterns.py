@@ -0,0 +1,230 @@
+"""
+Database of small deadlock patterns, shared by all levels.
+
+A pattern is the content of the cells around a box: walls, boxes or free
+floor. It is a deadlock pattern when some of its boxes can never leave
+their cell, whatever the rest of the level: cells outside the window are
+taken as free floor, where pushed boxes disappear, and the player can go
+to any free cell. Any box that stays stuck in these conditions is also
+stuck in a real level, so it has to be on a target.
+
+Patterns are computed once, normalized over rotations and reflections,
+and stored in a file that is loaded the first time it is needed.
+"""
+
+import os
+import sys
+from array import array
+from itertools import product
+import common as C
+
+# cells around the box at the center of a pattern, within two steps
+WINDOW = [(dx, dy) for dy in range(-2, 3) for dx in range(-2, 3)
+          if 0 < abs(dx) + abs(dy) <= 2]
+
+# the center is numbered after the cells of the window
+CENTER = len(WINDOW)
+
+# content of a cell, on two bits of the code of a pattern
+FLOOR = 0
+WALL = 1
+BOX = 2
+
+# precomputed patterns, only the smallest of symmetric patterns are stored
+FILENAME = os.path.join('assets', 'patterns.bin')
+MAGIC = b'SOKP'
+VERSION = 1
+
+# global variable, as for scores: loaded once for all levels
+database = None
+
+
+def get_database():
+    global database
+    if database is None:
+        database = Patterns()
+        database.load(FILENAME)
+    return database
+
+
+def symmetries():
+    """
+    For each of the 8 rotations and reflections, the cell of the window
+    where each cell is sent.
+    """
+    transforms = [
+        lambda x, y: (x, y), lambda x, y: (-y, x),
+        lambda x, y: (-x, -y), lambda x, y: (y, -x),
+        lambda x, y: (-x, y), lambda x, y: (y, x),
+        lambda x, y: (x, -y), lambda x, y: (-y, -x),
+    ]
+    return [[WINDOW.index(t(x, y)) for x, y in WINDOW] for t in transforms]
+
+
+def transform(code, perm):
+    """
+    Code of a pattern once its cells are moved according to 'perm'.
+    """
+    res = 0
+    for k, j in enumerate(perm):
+        res |= ((code >> 2*k) & 3) << 2*j
+    return res
+
+
+def stuck_boxes(code):
+    """
+    Mask of the cells where a box remains whatever the pushes made, with
+    the window surrounded by free floor.
+    """
+    cells = WINDOW + [(0, 0)]
+    index = {pos: k for k, pos in enumerate(cells)}
+    nbr = [[index.get((x+mx, y+my), -1) for mx, my in C.DIRS]
+           for x, y in cells]
+
+    walls = 0
+    start = 1 << CENTER
+    for k in range(CENTER):
+        c = (code >> 2*k) & 3
+        if c == WALL:
+            walls |= 1 << k
+        elif c == BOX:
+            start |= 1 << k
+
+    stuck = start
+    seen = {start}
+    todo = [start]
+    for boxes in todo:
+        stuck &= boxes
+        if not stuck:
+            return 0
+        full = boxes | walls
+        for k in range(CENTER+1):
+            if not boxes >> k & 1:
+                continue
+            for d in range(C.NUMDIRS):
+                player = nbr[k][C.OPPOSITE[d]]
+                if player >= 0 and full >> player & 1:
+                    continue
+                dest = nbr[k][d]
+                if dest < 0:
+                    # box leaves the window
+                    succ = boxes & ~(1 << k)
+                elif full >> dest & 1:
+                    continue
+                else:
+                    succ = boxes & ~(1 << k) | 1 << dest
+                if succ not in seen:
+                    seen.add(succ)
+                    todo.append(succ)
+    return stuck
+
+
+class Patterns:
+    """
+    Deadlock patterns, by code of the smallest of their symmetric patterns,
+    with the mask of the cells of their stuck boxes.
+    """
+
+    def __init__(self):
+        self.stuck = {}
+        # answers to previous queries, by code
+        self.cache = {}
+
+        # transform codes one byte (four cells) at a time
+        self.perms = symmetries()
+        self.tables = []
+        for perm in self.perms:
+            self.tables.append([[transform(b << 8*i, perm)
+                                 for b in range(256)] for i in range(3)])
+
+    def build(self):
+        """
+        Compute the deadlock patterns, the smallest code of each class of
+        symmetric patterns with its mask of stuck boxes.
+        """
+        codes = array('I')
+        masks = array('H')
+        done = set()
+        for cells in product((FLOOR, WALL, BOX), repeat=CENTER):
+            code = 0
+            for k, c in enumerate(cells):
+                code |= c << 2*k
+            if code in done:
+                continue
+            images = [transform(code, p) for p in self.perms]
+            done.update(images)
+            mask = stuck_boxes(min(images))
+            if mask:
+                codes.append(min(images))
+                masks.append(mask)
+        return codes, masks
+
+    def stuck_cells(self, code):
+        """
+        Cells of the window (CENTER for the box at the center) where boxes
+        are stuck, for the pattern with code 'code'. Empty if the pattern
+        is not a deadlock.
+        """
+        cells = self.cache.get(code)
+        if cells is not None:
+            return cells
+
+        lo = code & 255
+        mid = code >> 8 & 255
+        hi = code >> 16
+        images = [t0[lo] | t1[mid] | t2[hi] for t0, t1, t2 in self.tables]
+        canonical = min(images)
+        cells = []
+        mask = self.stuck.get(canonical, 0)
+        if mask:
+            perm = self.perms[images.index(canonical)]
+            cells = [k for k in range(CENTER) if mask >> perm[k] & 1]
+            if mask >> CENTER & 1:
+                cells.append(CENTER)
+
+        self.cache[code] = cells
+        return cells
+
+    def load(self, filename):
+        """
+        Read the patterns from 'filename', or compute them and save them
+        there if the file is missing or out of date.
+        """
+        codes = array('I')
+        masks = array('H')
+        try:
+            with open(filename, 'rb') as f:
+                header = f.read(len(MAGIC) + 1)
+                count = int.from_bytes(f.read(4), 'little')
+                if header != MAGIC + bytes([VERSION]):
+                    raise ValueError("outdated file")
+                codes.fromfile(f, count)
+                masks.fromfile(f, count)
+            if sys.byteorder == 'big':
+                codes.byteswap()
+                masks.byteswap()
+        except (OSError, EOFError, ValueError):
+            print("Computing deadlock patterns...")
+            codes, masks = self.build()
+            self.save(filename, codes, masks)
+
+        self.stuck = dict(zip(codes, masks))
+        self.cache = {}
+
+    def save(self, filename, codes, masks):
+        if sys.byteorder == 'big':
+            codes = array('I', codes)
+            masks = array('H', masks)
+            codes.byteswap()
+            masks.byteswap()
+        # written aside then renamed, for processes reading it meanwhile
+        tmp = filename + '.' + str(os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(MAGIC + bytes([VERSION]))
+                f.write(len(codes).to_bytes(4, 'little'))
+                codes.tofile(f)
+                masks.tofile(f)
+            os.replace(tmp, filename)
+        except OSError as e:
+            print("Cannot save deadlock patterns:", e)
@@ -0,0 +1,115 @@
+"""
+Portfolio solving: several configurations of the solver race on the same
+level, each in its own worker process. The first solution wins and the
+other searches are stopped. The name of the winning configuration is
+reported, to choose the default configuration from actual results.
+"""
+
+from background import BackgroundSolver
+from explore import OPTIMAL_MODES
+from utils import *
+
+# configurations by name, with their options for Level.solve_all_boxes
+CONFIGS = [
+    ('astar', {}),
+    ('greedy', {'mode': 'greedy'}),
+    ('closest', {'estimate': 'closest'}),
+    ('greedy-closest', {'mode': 'greedy', 'estimate': 'closest'}),
+    ('bidirectional', {'bidirectional': True}),
+    ('ida', {'engine': 'ida'}),
+]
+
+
+def mode_configs(mode, configs=CONFIGS):
+    """
+    Configurations of 'configs' searching in mode 'mode' (see
+    explore.MODES), with the mode added to their options. Those with a mode
+    of their own, or that cannot search in this mode, are left out, as well
+    as those that become the same as another one (those with the mode of
+    their own come first).
+    """
+    if mode == 'weighted':
+        return configs
+    selected = []
+    for name, options in sorted(configs, key=lambda c: 'mode' not in c[1]):
+        if options.get('mode', mode) != mode:
+            continue
+        if options.get('bidirectional') and mode in OPTIMAL_MODES:
+            continue
+        if options.get('engine') == 'ida' and mode == 'greedy':
+            continue
+        options = dict(options, mode=mode)
+        if options not in [o for _, o in selected]:
+            selected.append((name, options))
+    return selected
+
+
+class PortfolioSolver:
+    """
+    Solve the whole level with each configuration of 'configs' at once.
+    Same use as BackgroundSolver; 'winner' is the name of the configuration
+    that gave the result. The solution cache is not used if 'cached' is
+    False. Each configuration has its own 'budget', if given.
+    """
+
+    def __init__(self, level, levelnum, configs=CONFIGS, memory_limit=None,
+                 cached=True, budget=None):
+        self.solvers = []
+        for name, options in configs:
+            solver = BackgroundSolver(level, levelnum, 'all',
+                                      memory_limit=memory_limit,
+                                      cached=cached, budget=budget,
+                                      **options)
+            self.solvers.append((name, solver))
+        # last progress of each configuration
+        self.progress = {}
+        self.result = None
+        self.stats = None
+        self.search_stats = None
+        self.winner = None
+
+    def cancel(self):
+        for _, solver in self.solvers:
+            solver.cancel()
+
+    def poll(self):
+        """
+        Read what the workers have sent, without waiting.
+        Return the progress of all configurations together (states explored
+        by all of them, longest elapsed time) if any has progressed, or None.
+        """
+        changed = False
+        for name, solver in self.solvers:
+            progress = solver.poll()
+            if progress is not None:
+                self.progress[name] = progress
+                changed = True
+
+            if self.result is None and solver.result is not None \
+                    and solver.result[0]:
+                self.set_winner(name, solver)
+
+        if self.result is None \
+                and all(s.result is not None for _, s in self.solvers):
+            # no solution at all, the first configuration tells why
+            self.set_winner(*self.solvers[0])
+
+        if not changed:
+            return None
+        explored = sum(p[0] for p in self.progress.values())
+        elapsed = max(p[1] for p in self.progress.values())
+        return (explored, elapsed)
+
+    def set_winner(self, name, solver):
+        verbose("Portfolio won by", name)
+        found, message, path = solver.result
+        self.result = (found, message + " (" + name + ")", path)
+        self.stats = solver.stats
+        self.search_stats = solver.search_stats
+        self.winner = name
+        # the other searches are useless now
+        self.stop()
+
+    def stop(self):
+        for _, solver in self.solvers:
+            solver.stop()
@@ -0,0 +1,64 @@
+"""
+Solutions found previously, stored on disk so that solving again the same
+position is immediate.
+Levels are identified by a hash of their layout, so a solution is found
+again whatever the pack or the number of the level.
+"""
+
+import json
+import os
+
+FILENAME = "solution_cache.json"
+
+# global variable, as for scores: read once, shared by all levels
+cache = None
+
+
+def get_cache():
+    global cache
+    if cache is None:
+        cache = SolutionCache(FILENAME)
+    return cache
+
+
+class SolutionCache:
+    """
+    Solutions by key (see Level.solution_key): the pushes, as box position
+    and side of the player, and the moves in LURD notation.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, "r") as f:
+                self.solutions = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.solutions = {}
+
+    def get(self, key):
+        """
+        Return the pushes and moves stored for 'key', or None.
+        """
+        entry = self.solutions.get(key)
+        if entry is None:
+            return None
+        path = [(tuple(box), d) for box, d in entry['path']]
+        return path, entry['moves']
+
+    def put(self, key, path, moves, save=True):
+        self.solutions[key] = {
+            'path': [[list(box), d] for box, d in path],
+            'moves': moves,
+        }
+        if save:
+            self.save()
+
+    def save(self):
+        # written aside then renamed, not to leave a truncated file
+        tmp = self.filename + '.' + str(os.getpid())
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.solutions, f)
+            os.replace(tmp, self.filename)
+        except OSError as e:
+            print("Cannot save solutions:", e)
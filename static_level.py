@@ -0,0 +1,242 @@
+"""
+What the solver needs from a level, without the level itself: floor cells
+with their neighbours, targets, dead cells, push distances, tunnels and
+goal rooms, and the deadlock checks on positions given as bitboards.
+Cells are numbered as the interior floor cells of the level.
+Built once when the level is loaded and never modified afterwards, it can
+be shared by searches running in threads or sent to worker processes,
+without any access to the state of the game.
+"""
+
+import common as C
+from utils import *
+import patterns
+
+
+class StaticLevel:
+    """
+    Static structure of a level, with side-effect-free deadlock checks.
+    Cells outside of the floor are all seen as walls.
+    """
+
+    def __init__(self, level):
+        self.width = level.width
+        self.height = level.height
+        self.floor = tuple(level.floor)
+        self.floor_index = dict(level.floor_index)
+        self.neighbours = tuple(level.neighbours)
+
+        fi = self.floor_index
+        self.targets = tuple(level.targets)
+        self.targetbits = bitboard(fi[t] for t in level.targets)
+        self.deadbits = bitboard(i for i, pos in enumerate(self.floor)
+                                 if level.dead[level.index(pos)])
+
+        # number of pushes from each cell to each target
+        self.push_dist = level.push_dist
+        # tunnels and goal rooms, for macro pushes
+        self.tunnel = tuple(level.macros.tunnel)
+        self.rooms = level.macros.rooms
+
+        # walls around each cell, for the deadlock patterns
+        self.compute_windows()
+
+    def compute_windows(self):
+        """
+        Code of the walls in the window of the deadlock patterns around each
+        cell, the cells where boxes are looked for with their bit in the
+        code, and the cell at each place of the window (-1 for a wall).
+        """
+        self.window_walls = []
+        self.window_cells = []
+        self.window_index = []
+        for x, y in self.floor:
+            walls = 0
+            cells = []
+            index = []
+            for k, (dx, dy) in enumerate(patterns.WINDOW):
+                n = self.floor_index.get((x+dx, y+dy), -1)
+                index.append(n)
+                if n >= 0:
+                    cells.append((n, patterns.BOX << 2*k))
+                else:
+                    walls |= patterns.WALL << 2*k
+            self.window_walls.append(walls)
+            self.window_cells.append(tuple(cells))
+            self.window_index.append(tuple(index))
+
+    def lost(self, boxes, player, pushed=None):
+        """
+        Some heuristics to determine if boxes on the cells of bitboard
+        'boxes', with the player on cell 'player', are in an unsolvable
+        state:
+        - box along a unescapable wall without target
+        - boxes forming a square
+        - in general, box that can no longer reach any target
+        - frozen boxes (that can never move again) not on a target
+        - area closed off by frozen boxes with a target that cannot be
+          filled anymore
+        - boxes around matching a deadlock pattern of the database
+        If 'pushed' is given, only the box last pushed, on this cell, is
+        checked, as the other boxes have been checked already.
+        """
+        nbr = self.neighbours
+        targets = self.targetbits
+
+        if pushed is not None:
+            # most deadlocks after a push are known patterns, cheap to look up
+            if self.pattern_deadlock(pushed, boxes):
+                return True
+            checked = [pushed]
+        else:
+            checked = list(bit_indices(boxes))
+
+        def is_full(i):
+            return i < 0 or boxes >> i & 1
+
+        # check if some boxes are in wall corners
+        for b in checked:
+            if targets >> b & 1:
+                continue
+            if self.deadbits >> b & 1:
+                return True
+            prev = False
+            for d in C.AROUND:
+                side = nbr[4*b+d]
+                blocked = side < 0
+                if prev and blocked:
+                    return True
+                if not blocked and boxes >> side & 1:
+                    # check above and below, or left and right
+                    if horizontal(d):
+                        d1, d2 = C.UP, C.DOWN
+                    else:
+                        d1, d2 = C.LEFT, C.RIGHT
+                    if is_full(nbr[4*b+d1]) and is_full(nbr[4*side+d1]) \
+                            or is_full(nbr[4*b+d2]) \
+                            and is_full(nbr[4*side+d2]):
+                        return True
+                prev = blocked
+
+        for b in checked:
+            if pushed is None and self.pattern_deadlock(b, boxes):
+                return True
+
+            walled = set()
+            budget = [C.FREEZE_BUDGET]
+            if not self.box_frozen(b, boxes, walled, budget):
+                continue
+            for w in walled:
+                if not targets >> w & 1:
+                    return True
+            # an area can only be closed off by frozen boxes
+            if pushed is not None \
+                    and self.corral_deadlock(b, boxes, player, walled):
+                return True
+
+        return False
+
+    def pattern_deadlock(self, box, boxes):
+        """
+        Look up the boxes around cell 'box' in the database of deadlock
+        patterns: boxes that are stuck whatever the rest of the level have
+        to be on targets.
+        """
+        code = self.window_walls[box]
+        for n, bit in self.window_cells[box]:
+            if boxes >> n & 1:
+                code |= bit
+
+        index = self.window_index[box]
+        for k in patterns.get_database().stuck_cells(code):
+            cell = box if k == patterns.CENTER else index[k]
+            if not self.targetbits >> cell & 1:
+                return True
+        return False
+
+    def box_frozen(self, box, boxes, walled, budget):
+        """
+        Check if the box on cell 'box' can never be pushed anymore.
+        Boxes in 'walled' are considered as walls, 'box' and the boxes it
+        depends on are added to it when it is frozen. budget[0] is the
+        number of boxes that can still be examined.
+        """
+        before = set(walled)
+        if self.axis_blocked(box, C.LEFT, C.RIGHT, boxes, walled, budget) \
+                and self.axis_blocked(box, C.UP, C.DOWN, boxes, walled,
+                                      budget):
+            walled.add(box)
+            return True
+        walled.intersection_update(before)
+        return False
+
+    def axis_blocked(self, box, d1, d2, boxes, walled, budget):
+        """
+        Check if the box on cell 'box' can never be pushed along the axis of
+        directions d1 and d2: a wall on one side, dead cells on both sides,
+        or a frozen box on one side (assuming 'box' does not move).
+        """
+        s1 = self.neighbours[4*box+d1]
+        s2 = self.neighbours[4*box+d2]
+        if s1 < 0 or s2 < 0 or s1 in walled or s2 in walled:
+            return True
+        if self.deadbits >> s1 & 1 and self.deadbits >> s2 & 1:
+            return True
+
+        budget[0] -= 1
+        if budget[0] < 0:
+            # too costly, assume it can move
+            return False
+
+        walled.add(box)
+        for s in s1, s2:
+            if boxes >> s & 1 and self.box_frozen(s, boxes, walled, budget):
+                return True
+        walled.discard(box)
+        return False
+
+    def corral_deadlock(self, box, boxes, player, walled):
+        """
+        Check the areas next to the frozen box on cell 'box' that the player
+        cannot reach. If all boxes around such an area are frozen, nothing
+        can ever enter it, so a target inside is lost when all targets have
+        to be filled. 'walled' are boxes already known to be frozen.
+        """
+        if bin(boxes).count('1') != len(self.targets):
+            return False
+
+        nbr = self.neighbours
+        for d in range(C.NUMDIRS):
+            start = nbr[4*box+d]
+            if start < 0 or boxes >> start & 1:
+                continue
+
+            # explore the area, an empty target has to be inside
+            area = {start}
+            fifo = [start]
+            border = set()
+            has_target = False
+            for c in fifo:
+                if c == player or len(area) > C.CORRAL_BUDGET:
+                    break
+                if self.targetbits >> c & 1:
+                    has_target = True
+                for dd in range(C.NUMDIRS):
+                    n = nbr[4*c+dd]
+                    if n < 0 or n in area:
+                        continue
+                    if boxes >> n & 1:
+                        border.add(n)
+                    else:
+                        area.add(n)
+                        fifo.append(n)
+            else:
+                # area closed off from the player
+                if not has_target:
+                    continue
+                budget = [C.FREEZE_BUDGET]
+                if all(b in walled or self.box_frozen(b, boxes, walled, budget)
+                       for b in border):
+                    return True
+
+        return False
@@ -77,3 +77,21 @@ def valid_soko_line(l):
         if l[i] != ' ':
             return False
     return True
+
+
+# bitboard helpers: sets of cell indices stored as a single integer
+def bitboard(indices):
+    b = 0
+    for i in indices:
+        b |= 1 << i
+    return b
+
+
+def bit_indices(b):
+    """
+    Iterate over the indices of the bits set in 'b', lowest first.
+    """
+    while b:
+        low = b & -b
+        yield low.bit_length() - 1
+        b ^= low